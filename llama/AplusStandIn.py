@@ -0,0 +1,217 @@
+import io
+import csv
+import json
+import random
+import threading
+import time
+import datetime
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class AplusStandIn:
+
+  # Local stand-in for the A-plus API endpoints that AplusApi uses,
+  # with configurable data volume, response latency and error rate.
+
+  COURSE_ID = 1
+  PAGE_LIMIT = 100
+
+  def __init__(self, exercises=20, submissions=50, persons=20, file_size=1000, latency=0, error_rate=0, seed=0):
+    self.exercises = exercises
+    self.submissions = submissions
+    self.persons = persons
+    self.file_size = file_size
+    self.latency = latency
+    self.error_rate = error_rate
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.request_count = 0
+    self.byte_count = 0
+    self.server = None
+    self.url = None
+
+  def start(self):
+    standin = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_GET(self):
+        status, headers, body = standin.respond(self.path, self.headers)
+        self.send_response(status)
+        for k, v in headers.items():
+          self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        standin.count(len(body))
+
+      def log_message(self, format, *args):
+        pass
+
+    self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+    self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    return self.url
+
+  def stop(self):
+    if not self.server is None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+  def count(self, n_bytes):
+    with self.lock:
+      self.request_count += 1
+      self.byte_count += n_bytes
+
+  def stats(self):
+    with self.lock:
+      return { 'requests': self.request_count, 'bytes': self.byte_count }
+
+  def respond(self, path, headers):
+    if self.latency > 0:
+      time.sleep(self.latency)
+    with self.lock:
+      failed = self.random.random() < self.error_rate
+    if failed:
+      return 500, {}, b''
+    parts = urlsplit(path)
+    query = { k: v[0] for k, v in parse_qs(parts.query).items() }
+    p = [s for s in parts.path.split('/') if s]
+    if p[:2] == ['api', 'v2']:
+      p = p[2:]
+      if p == ['courses']:
+        return self.json_page(path, [self.course()], query)
+      if len(p) == 3 and p[0] == 'courses' and p[2] == 'exercises':
+        return self.json_page(path, [self.module(m) for m in range(self.modules())], query)
+      if len(p) == 3 and p[0] == 'courses' and p[2] == 'submissiondata':
+        return 200, { 'Content-Type': 'text/csv; charset=utf-8' }, self.submission_csv(int(query['exercise_id']))
+      if len(p) == 2 and p[0] == 'exercises':
+        return self.exercise_details(int(p[1]), headers)
+      if len(p) == 2 and p[0] == 'submissions':
+        return self.json(self.submission_details(int(p[1])))
+    elif len(p) == 3 and p[0] == 'files':
+      return 200, {
+        'Content-Type': 'text/plain',
+        'Content-Disposition': f'attachment; filename="{p[2]}"',
+      }, self.file_content(int(p[1]))
+    return 404, {}, b''
+
+  @staticmethod
+  def json(data, status=200, headers=None):
+    return status, { 'Content-Type': 'application/json', **(headers or {}) }, json.dumps(data).encode()
+
+  def json_page(self, path, results, query):
+    limit = int(query.get('limit', self.PAGE_LIMIT))
+    offset = int(query.get('offset', 0))
+    base = urlsplit(path).path
+    return self.json({
+      'count': len(results),
+      'next': f'{self.url}{base}?limit={limit}&offset={offset + limit}' if offset + limit < len(results) else None,
+      'previous': None,
+      'results': results[offset:offset + limit],
+    })
+
+  def modules(self):
+    return (self.exercises + 9) // 10
+
+  def course(self):
+    return {
+      'id': self.COURSE_ID,
+      'code': 'CS-0000',
+      'name': 'Stand-in course',
+      'instance_name': 'benchmark',
+      'html_url': f'{self.url}/course/benchmark/',
+    }
+
+  def module(self, m):
+    return {
+      'id': m + 1,
+      'display_name': f'en:Module {m + 1}|fi:Moduuli {m + 1}',
+      'exercises': [
+        {
+          'id': e + 1,
+          'display_name': f'en:Exercise {e + 1}',
+          'max_points': 10,
+          'max_submissions': 10,
+          'difficulty': '',
+          'url': f'{self.url}/api/v2/exercises/{e + 1}/',
+        }
+        for e in range(m * 10, min(self.exercises, (m + 1) * 10))
+      ],
+    }
+
+  def exercise_details(self, exercise_id, headers):
+    etag = f'"exercise-{exercise_id}"'
+    if headers.get('If-None-Match') == etag:
+      return 304, { 'ETag': etag }, b''
+    return self.json({
+      'id': exercise_id,
+      'exercise_info': {
+        'form_spec': [
+          { 'key': 'file1', 'type': 'file' },
+          { 'key': 'field_0', 'type': 'radio' },
+          { 'key': 'info', 'type': 'static' },
+        ],
+      },
+    }, headers={ 'ETag': etag })
+
+  def submission_ids(self, exercise_id):
+    return range(exercise_id * 100000, exercise_id * 100000 + self.submissions)
+
+  def submission_row(self, submission_id):
+    exercise_id = submission_id // 100000
+    person = 100 + submission_id * 7919 % self.persons
+    time = datetime.datetime(2021, 1, 1) + datetime.timedelta(minutes=submission_id % 100000)
+    return {
+      'SubmissionID': submission_id,
+      'Time': time.isoformat(),
+      'UserID': person,
+      'StudentID': f'{person:06d}',
+      'Email': f'student{person}@example.org',
+      'Status': 'ready' if submission_id % 20 else 'error',
+      'Category': 'Exercises',
+      'ExerciseID': exercise_id,
+      'Exercise': f'Exercise {exercise_id}',
+      'Grade': submission_id % 11,
+      'Penalty': 0.5 if submission_id % 13 == 0 else 0.0,
+      'Graded': True,
+      'GraderEmail': '',
+      'Notified': False,
+      'NSeen': 0,
+      'file1': f'{self.url}/files/{submission_id}/solution.py?download=yes',
+      'field_0': submission_id % 3,
+    }
+
+  def submission_csv(self, exercise_id):
+    out = io.StringIO()
+    writer = None
+    for i in self.submission_ids(exercise_id):
+      row = self.submission_row(i)
+      if writer is None:
+        writer = csv.DictWriter(out, fieldnames=list(row.keys()))
+        writer.writeheader()
+      writer.writerow(row)
+    return out.getvalue().encode()
+
+  def submission_details(self, submission_id):
+    row = self.submission_row(submission_id)
+    return {
+      'id': submission_id,
+      'exercise': { 'id': row['ExerciseID'] },
+      'submission_time': row['Time'],
+      'grading_time': row['Time'],
+      'grade': row['Grade'],
+      'late_penalty_applied': row['Penalty'] or None,
+      'feedback': '<p>Good work!</p>',
+      'grading_data': { 'points': row['Grade'] },
+    }
+
+  def file_content(self, submission_id):
+    line = f'# Nimi: Student {submission_id}\nprint({submission_id})\n'
+    return (line * (self.file_size // len(line) + 1))[:max(self.file_size, len(line))].encode()
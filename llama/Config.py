@@ -14,6 +14,28 @@ TIME_KEY = 'Time'
 PERSON_KEY = 'Person'
 GRADE_KEY = 'Grade'
 
+# Defaults for the optional 'storage' configuration
+STORAGE_DEFAULTS = {
+  'tables': 'csv', # csv, parquet, or feather
+  'files': 'dirs', # dirs, blobs or packed
+  'compression': None, # None, gzip or zstd for files and tables
+  'level': None, # compression level, None for the codec default
+  'compress_export': False,
+}
+
+# Defaults for the optional 'fetch' configuration
+FETCH_DEFAULTS = {
+  'workers': 1, # upper bound for parallel requests per host
+  'rate': 4.0, # upper bound for requests per second per host
+  'start_rate': 1.0,
+  'min_rate': 0.25,
+  'latency': 5.0, # sec, slower responses reduce rate and parallel requests
+  'burst': 1,
+  'retries': 3,
+  'backoff': 1.0, # sec, doubles for each retry
+  'timeout': 60, # sec
+}
+
 class Config:
 
   def __init__(self):
@@ -75,6 +97,32 @@ class Config:
     self.data['exclude'] = list(exclude)
     self.write()
 
+  @property
+  def storage(self):
+    return { **STORAGE_DEFAULTS, **self.data.get('storage', {}) }
+
+  def set_storage(self, storage):
+    self.data['storage'] = dict(storage)
+    self.write()
+
+  def storage_roots(self):
+    # Storage options with the item directories of the working directory
+    storage = self.storage
+    return {
+      **storage,
+      'roots': [STORAGE_DIR, EXPORT_DIR],
+      'compressed_roots': [STORAGE_DIR] + ([EXPORT_DIR] if storage['compress_export'] else []),
+      'manifest_roots': [STORAGE_DIR],
+    }
+
+  @property
+  def fetch(self):
+    return { **FETCH_DEFAULTS, **self.data.get('fetch', {}) }
+
+  def set_fetch(self, fetch):
+    self.data['fetch'] = dict(fetch)
+    self.write()
+
   @staticmethod
   def write_gitignore():
     ignore_lines = [f'{TOKENS_FILE}\n', f'{STORAGE_DIR}/\n']
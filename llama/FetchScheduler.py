@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .common import configure_storage, storage_options, configure_parse_workers
+
+def fetch_table_rows(api, table, include_personal, persons):
+  columns_rm = [c['key'] for c in table['columns_rm']] if 'columns_rm' in table else None
+  rows, _ = api.fetch_rows(table, include_personal, False, persons, columns_rm)
+  return 0 if rows is None else rows.shape[0]
+
+def fetch_source_rows(source_name, api, tables, include_personal, persons, storage=None, parse_workers=None):
+  # Runs in a worker process, or in a thread when it is the only parsing source:
+  # tables of one source share the parsed data
+  if not storage is None:
+    configure_storage(storage)
+  configure_parse_workers(parse_workers)
+  for i, t in enumerate(tables):
+    n = fetch_table_rows(api, t, include_personal, persons)
+    print(f'[{source_name}] {i + 1}/{len(tables)} {t["name"]}: {n} rows')
+  return len(tables)
+
+class FetchScheduler:
+
+  # Sources are fetched concurrently: network sources with threads limited per source,
+  # sources that parse local files with a process per source. A single parsing source
+  # runs in this process so that it can parse its files in a process pool of its own.
+
+  def __init__(self, workers=None):
+    self.workers = workers
+    self.lock = threading.Lock()
+    self.done = {}
+
+  def run(self, sources, include_personal, persons):
+    process_sources = [s for s in sources if s['api'].FETCH_POOL == 'process']
+    thread_sources = [s for s in sources if not s in process_sources]
+    futures = []
+    pools = []
+    try:
+      if process_sources:
+        inline = len(process_sources) == 1
+        pool_type = ThreadPoolExecutor if inline else ProcessPoolExecutor
+        processes = pool_type(max_workers=self.process_workers(process_sources))
+        pools.append(processes)
+        for s in process_sources:
+          args = () if inline else (storage_options(), 1)
+          futures.append((s, processes.submit(
+            fetch_source_rows, s['name'], s['api'], s['tables'], include_personal, persons, *args
+          )))
+      for s in thread_sources:
+        pool = ThreadPoolExecutor(max_workers=self.source_workers(s))
+        pools.append(pool)
+        for t in s['tables']:
+          futures.append((s, pool.submit(self.fetch_table, s, t, include_personal, persons)))
+      failed = []
+      for s, f in futures:
+        try:
+          f.result()
+        except Exception as e:
+          print(f'[{s["name"]}] failed: {e!r}')
+          if not s['name'] in failed:
+            failed.append(s['name'])
+    finally:
+      for pool in pools:
+        pool.shutdown()
+    return failed
+
+  def fetch_table(self, source, table, include_personal, persons):
+    n = fetch_table_rows(source['api'], table, include_personal, persons)
+    with self.lock:
+      self.done[source['name']] = self.done.get(source['name'], 0) + 1
+      i = self.done[source['name']]
+    print(f'[{source["name"]}] {i}/{len(source["tables"])} {table["name"]}: {n} rows')
+
+  def source_workers(self, source):
+    workers = self.workers or source['api'].fetch_options['workers']
+    return max(1, min(workers, len(source['tables'])))
+
+  @staticmethod
+  def process_workers(sources):
+    return max(1, min(len(sources), os.cpu_count() or 1))
@@ -7,6 +7,7 @@ class Filters:
   # PERSONS:
   #   Select INCLUSION
   #   THEN Store each Pseudo-User and whether all selected columns MATCH with value
+  #   (from cached rows, recomputed only when the filters or the tables change)
   # INCLUSIONS:
   #   Select MATCHING sources OR all
   #   From THOSE Select MATCHING tables OR all
@@ -44,17 +45,47 @@ class Filters:
     for f in self.person_filters:
       yield f, self._inclusion([f], sources)
 
-  def person_select(self, sources, include_personal):
-    persons = {}
-    for f, sources in self.person_filter_columns(sources):
-      for s in sources:
+  def person_tables(self, sources):
+    # Each table that person filters read, once
+    seen = set()
+    for _, selected in self.person_filter_columns(sources):
+      for s in selected:
         for t in s['tables']:
-          rows, _ = s['api'].fetch_rows(t, include_personal)
-          if not rows is None:
-            for p, m in person_has_columns_value(rows, t['columns'], f['value'], not f['reverse']):
-              persons[p] = persons.get(p, True) and m
-    write_json(self.PERSON_SELECT_JSON, [{ 'person': p, 'included': m } for p, m in persons.items()])
-    return [p for p, m in persons.items() if m]
+          if not (s['id'], t['id']) in seen:
+            seen.add((s['id'], t['id']))
+            yield s, t
+
+  def person_select(self, sources):
+    # Reads cached rows only, the person tables are fetched before selection
+    inputs = [
+      [f['value'], f['reverse'], s['id'], t['id'], [c['key'] for c in t['columns']], s['api'].table_version(t['id'])]
+      for f, selected in self.person_filter_columns(sources)
+      for s in selected
+      for t in s['tables']
+    ]
+    stored = read_json(self.PERSON_SELECT_JSON)
+    if isinstance(stored, dict) and stored.get('inputs') == inputs:
+      persons = stored['persons']
+    else:
+      tables = {}
+      seen = {}
+      rejected = set()
+      for f, selected in self.person_filter_columns(sources):
+        for s in selected:
+          for t in s['tables']:
+            key = (s['id'], t['id'])
+            if not key in tables:
+              tables[key], _ = s['api'].fetch_rows(t, only_cache=True)
+            rows = tables[key]
+            if rows is None:
+              print(f'Skipping {t["name"]}: fetch rows first')
+            else:
+              match = person_has_columns_value(rows, t['columns'], f['value'], not f['reverse'])
+              seen.update(dict.fromkeys(match.index))
+              rejected.update(match.index[~match.to_numpy()])
+      persons = [{ 'person': p, 'included': not p in rejected } for p in seen]
+      write_json(self.PERSON_SELECT_JSON, { 'inputs': inputs, 'persons': persons })
+    return [p['person'] for p in persons if p['included']]
   
   def filter(self, sources):
     out = self._inclusion(self.inclusions, sources) if self.inclusions else sources
@@ -64,7 +95,8 @@ class Filters:
 
   @classmethod
   def _person_json(cls):
-    return read_json(cls.PERSON_SELECT_JSON)
+    persons = read_json(cls.PERSON_SELECT_JSON)
+    return persons['persons'] if isinstance(persons, dict) else persons
 
   @classmethod
   def person_status(cls):
@@ -5,7 +5,7 @@ from .ProgSnap2 import ProgSnap2
 from .operations import filter_by_person, ensure_column_types
 from .plotting import multipage_plot_or_show
 from .common import (
-  require, as_list, read_json, read_csv,
+  require, as_list, read_json, read_table, register_item_root,
   write_or_print, df_from_iterator
 )
 
@@ -24,6 +24,7 @@ class LlamaApi:
   def _read_dir(self, dir):
     index = read_json((dir, EXPORT_INDEX_JSON))
     require(not index is None, f'Unable to read {dir}/{EXPORT_INDEX_JSON}')
+    register_item_root(dir)
     l = len(self.sources)
     for i, s in enumerate(index.get('sources', [])):
       tables = read_json((dir, s['index_file']))
@@ -50,14 +51,23 @@ class LlamaApi:
         persons.update(s['persons'])
     return persons if len(persons) > 0 else None
 
+  def _read(self, s, t, file_key):
+    p_in = self._persons(t.get('inc_filters'))
+    p_out = self._persons(t.get('exc_filters'))
+    rows = filter_by_person(read_table((s['dir'], t[file_key])), p_in, p_out)
+    ensure_column_types(rows)
+    return rows
+
   def get(self, select=None):
     for s in self._select(select):
       for t in s['tables']:
-        p_in = self._persons(t.get('inc_filters'))
-        p_out = self._persons(t.get('exc_filters'))
-        rows = filter_by_person(read_csv((s['dir'], t['data_file'])), p_in, p_out)
-        ensure_column_types(rows)
-        yield s, t, rows
+        yield s, t, self._read(s, t, 'data_file')
+
+  def events(self, select=None):
+    for s in self._select(select):
+      for t in s['tables']:
+        if 'events_file' in t:
+          yield s, t, self._read(s, t, 'events_file')
 
   def progsnap2(self, select, export_dir, acos_initial_codes=None):
     exporter = ProgSnap2(self.get(select), export_dir, acos_initial_codes)
@@ -1,11 +1,12 @@
 import re
-import json
 import os
 import pandas
 
-from .common import read_text, mkdir
+from .common import read_text, read_table, mkdir
 from .Config import GRADE_KEY, PERSON_KEY, TIME_KEY
+from .operations import ensure_column_types
 from .types.AplusApi import AplusApi
+from .types.AcosJsonApi import SUBMISSION_KEY, log_events
 
 class ProgSnap2:
 
@@ -49,7 +50,20 @@ class ProgSnap2:
     return ts.isoformat(timespec='seconds')
 
   def format_ms_time(self, ms):
-    return self.format_time(pandas.Timestamp(ms, unit='ms'))
+    return None if pandas.isna(ms) else self.format_time(pandas.Timestamp(int(ms), unit='ms'))
+
+  def format_location(self, row, column):
+    return None if pandas.isna(row) or pandas.isna(column) else f'Text:{int(row)}:{int(column)}'
+
+  def acos_events(self, source, table, rows):
+    # Events are normalized at fetch, older exports are normalized here
+    if 'events_file' in table:
+      events = ensure_column_types(read_table((source['dir'], table['events_file'])))
+    elif 'log' in rows.columns:
+      events = log_events(rows)
+    else:
+      return None
+    return dict(iter(events.groupby([PERSON_KEY, TIME_KEY, SUBMISSION_KEY], sort=False)))
 
   def process(self):
     for source, table, rows in self.selection:
@@ -58,7 +72,7 @@ class ProgSnap2:
       tool_instance = 'Unknown'
       file_path_columns = None
       file_content_columns = None
-      log_column = None
+      submissions = None
       if source['type'] == 'aplus':
         tool_instance = 'Aplus'
         file_path_columns = list(c for c in rows.columns if self.file_key_re.match(c))
@@ -66,7 +80,7 @@ class ProgSnap2:
         file_content_columns = list(c for c in rows.columns if c.endswith('_contents'))
       elif source['type'] == 'acosjson':
         tool_instance = 'Acos'
-        log_column = 'log' if 'log' in rows.columns else None
+        submissions = self.acos_events(source, table, rows)
         init_code = self.acos_initial_codes.get(table['name'])
         if not init_code:
           init_code = ''
@@ -74,7 +88,9 @@ class ProgSnap2:
         else:
           init_code_id = self.append_codestate(init_code)
 
-      for _, row in rows.iterrows():
+      # Rows that share person and time are told apart by their ordinal
+      ordinals = rows.groupby([PERSON_KEY, TIME_KEY], sort=False, dropna=False).cumcount().to_numpy()
+      for ordinal, (_, row) in zip(ordinals, rows.iterrows()):
         defs = {
           'ToolInstances': tool_instance,
           'AssignmentID': table['id'],
@@ -84,54 +100,54 @@ class ProgSnap2:
 
         code_id = None
         if file_path_columns:
-          code_id = self.append_codestate('\n'.join(read_text(row[c]) for c in file_path_columns))
+          code_id = self.append_codestate('\n'.join(
+            read_text((source['dir'],) + tuple(os.path.normpath(row[c]).split(os.sep))) or ''
+            for c in file_path_columns
+          ))
         elif file_content_columns:
           code_id = self.append_codestate('\n'.join(row[c] for c in file_content_columns))
 
-        if log_column:
+        if not submissions is None:
           code_id = code_id or self.unknown_codestate()
-          qlcs = None
-          events_list = json.loads(row[log_column])
-          includes_editor = any(e.get('type') == 'editor-change' for e in events_list)
-          for event in events_list if includes_editor else []:
-            type = event.get('type')
+          events = submissions.get((row[PERSON_KEY], row[TIME_KEY], ordinal))
+          includes_editor = not events is None and (events['type'] == 'editor-change').any()
+          for event in events.itertuples() if includes_editor else []:
+            type = event.type
             if type == 'reset':
               self.append_event({
                 **defs,
-                'ClientTimestamp': self.format_ms_time(event['time']),
+                'ClientTimestamp': self.format_ms_time(event.time),
                 'EventType': 'File.Create',
                 'CodeStateID': str(init_code_id),
                 'CodeStateSection': 'default',
                 'X-InsertText': init_code,
               })
-            elif type == 'editor-change' and event.get('action') in ('insert', 'remove'):
-              is_insert = event['action'] == 'insert'
+            elif type == 'editor-change' and event.action in ('insert', 'remove'):
+              is_insert = event.action == 'insert'
               self.append_event({
                 **defs,
-                'ClientTimestamp': self.format_ms_time(event['time']),
+                'ClientTimestamp': self.format_ms_time(event.time),
                 'EventType': 'File.Edit',
                 'CodeStateID': str(code_id),
                 'CodeStateSection': 'default',
                 'EditType': 'Insert' if is_insert else 'Delete',
-                'SourceLocation': f'Text:{event["start"]["row"]}:{event["start"]["column"]}',
-                'X-InsertText': '\n'.join(event['lines']) if is_insert else None,
-                'X-DeleteText': '\n'.join(event['lines']) if not is_insert else None,
+                'SourceLocation': self.format_location(event.start_row, event.start_column),
+                'X-InsertText': event.lines if is_insert else None,
+                'X-DeleteText': event.lines if not is_insert else None,
               })
-            elif type == 'qlc-init':
-              qlcs = event.get('qlcs')
             elif type == 'qlc-select':
               self.append_event({
                 **defs,
-                'ClientTimestamp': self.format_ms_time(event['time']),
+                'ClientTimestamp': self.format_ms_time(event.time),
                 'EventType': 'X-QLC.Answer',
                 'CodeStateID': str(code_id),
-                'X-QLC.Type': qlcs[event['qlc']]['qlctype'],
-                'X-QLC.AnswerType': event['option']['qlctype'],
-                'X-QLC.AnswerText': event['option']['answer'],
-                'Score': 1 if event['option'].get('correct', False) else 0,
+                'X-QLC.Type': event.qlc_type,
+                'X-QLC.AnswerType': event.answer_type,
+                'X-QLC.AnswerText': event.answer_text,
+                'Score': 1 if event.correct else 0,
               })
 
-          if not log_column or row.get('status') == 'graded':
+          if submissions is None or row.get('status') == 'graded':
             self.append_event({
               **defs,
               'EventType': 'Submit',
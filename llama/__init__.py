@@ -1,5 +1,5 @@
 import sys
-from .common import find, require
+from .common import find, require, configure_storage
 from .Config import Config, TIME_KEY, PERSON_KEY, GRADE_KEY
 from . import status
 from . import sources
@@ -9,6 +9,8 @@ from . import exclude
 from . import fetch
 from . import anonymize
 from . import shell
+from . import benchmark
+from . import storage
 from .LlamaApi import LlamaApi
 from .LlamaStats import LlamaStats
 
@@ -41,6 +43,12 @@ COMMANDS = [
     'require': ['config', 'source'],
     'call': exclude.command,
   },
+  {
+    'cmd': 'storage',
+    'desc': 'Configure storage formats (default: csv tables, files in dirs)',
+    'require': ['config'],
+    'call': storage.command,
+  },
   {
     'cmd': 'fetch',
     'desc': 'Fetch data from sources',
@@ -57,13 +65,19 @@ COMMANDS = [
     'cmd': 'shell',
     'desc': 'Open python REPL with \'llama\' instance to export data',
     'call': shell.command,
-  }
+  },
+  {
+    'cmd': 'benchmark',
+    'desc': 'Measure fetch throughput against a local stand-in server',
+    'call': benchmark.command,
+  },
 ]
 
 def llama_cli(cmd, args):
   definition = find(COMMANDS, lambda c: c['cmd'] == cmd)
   require(definition, 'Unknown command')
   config = Config()
+  configure_storage(config.storage_roots())
   requirements = definition.get('require', [])
   if 'config' in requirements:
     require(config.exists, 'The working directory has no configuration (.llama)')
@@ -1,9 +1,11 @@
+import os
 import random
 
 from .types import get_sources_with_tables
 from .Filters import Filters
 from .Config import PERSON_KEY, EXPORT_DIR, EXPORT_INDEX_JSON
-from .common import write_any, write_json, write_csv
+from .operations import ensure_column_types
+from .common import copy_item, write_json, read_table, write_table
 
 def add_to_person_map(person_map, person_included, rows):
   for p in rows[PERSON_KEY]:
@@ -13,6 +15,9 @@ def add_to_person_map(person_map, person_included, rows):
         ap = random.randint(1000, 9999)
       person_map[p] = ap
 
+def export_file_name(table_file):
+  return os.path.relpath(table_file, EXPORT_DIR).replace(os.sep, '/')
+
 def command(args, config):
   sources = []
   person_map = {}
@@ -36,27 +41,35 @@ def command(args, config):
 
         table_dir = s['api'].table_dir_name(t['id'])
         for r in s['api'].fetch_files(t, rows, only_cache=True):
-          if not r['content'] is None:
+          if r['cached']:
             p = person_map.get(r['row'][PERSON_KEY])
             if not p is None:
               item_dir = s['api'].item_dir_name({ **r['row'], PERSON_KEY: p })
-              write_any((EXPORT_DIR, table_dir, item_dir, r['col']), r['content'])
+              copy_item(r['path'], (EXPORT_DIR, table_dir, item_dir, r['col']))
         metas = False
         meta_file = s['api'].META_JSON
         for r in s['api'].fetch_meta(t, rows, only_cache=True):
-          if not r['content'] is None:
+          if r['cached']:
             p = person_map.get(r['row'][PERSON_KEY])
             if not p is None:
               item_dir = s['api'].item_dir_name({ **r['row'], PERSON_KEY: p })
-              write_json((EXPORT_DIR, table_dir, item_dir, meta_file), r['content'])
+              copy_item(r['path'], (EXPORT_DIR, table_dir, item_dir, meta_file))
             metas = True
 
         table_csv = s['api'].table_csv_name(t['id'])[1:]
         export_rows = s['api'].export_rows(t, rows, person_map, metas, args)
-        write_csv((EXPORT_DIR,) + table_csv, export_rows)
+        table_file = write_table((EXPORT_DIR,) + table_csv, export_rows)
+        sidecars = {}
+        for key, path in s['api'].sidecar_tables(t):
+          sidecar_rows = ensure_column_types(read_table(path))
+          if not sidecar_rows is None:
+            sidecar_rows[PERSON_KEY] = sidecar_rows[PERSON_KEY].map(person_map)
+            sidecar_rows = sidecar_rows.dropna(subset=[PERSON_KEY]).reset_index(drop=True)
+            sidecars[key] = export_file_name(write_table((EXPORT_DIR,) + path[1:], sidecar_rows))
         tables.append({
           **t,
-          'data_file': '/'.join(table_csv)
+          'data_file': export_file_name(table_file),
+          **sidecars,
         })
         print(f'Anonymized {t["name"]}')
     
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from .AplusStandIn import AplusStandIn
+from .Config import Config
+from .common import require, pop_option
+from .list import command as list_command
+from .fetch import command as fetch_command
+
+OPTIONS = (
+  ('--exercises', int, 20),
+  ('--submissions', int, 50),
+  ('--persons', int, 20),
+  ('--file-size', int, 1000),
+  ('--latency', float, 0.0),
+  ('--errors', float, 0.0),
+  ('--workers', int, 4),
+  ('--rate', float, 100.0),
+)
+
+PHASES = (
+  ('list', lambda config: list_command(['update'], config)),
+  ('fetch rows', lambda config: fetch_command(['rows'], config)),
+  ('fetch files', lambda config: fetch_command(['files'], config)),
+  ('fetch meta', lambda config: fetch_command(['meta'], config)),
+)
+
+def parse_options(args):
+  options = {}
+  for name, type, default in OPTIONS:
+    value = pop_option(args, name)
+    try:
+      options[name[2:]] = default if value is None else type(value)
+    except ValueError:
+      require(False, f'Invalid value for {name}')
+  return options
+
+def format_phase(name, stats, seconds):
+  return '{: <12}{: >9d}{: >12d}{: >9.2f}{: >10.1f}{: >12.0f}'.format(
+    name,
+    stats['requests'],
+    stats['bytes'],
+    seconds,
+    stats['requests'] / seconds,
+    stats['bytes'] / seconds
+  )
+
+def command(args, config):
+  args = list(args)
+  verbose = '--verbose' in args
+  if verbose:
+    args.remove('--verbose')
+  options = parse_options(args)
+  if args:
+    print('Measures fetch throughput against a local A-plus stand-in server\n')
+    print('usage: llama benchmark [--<option> <value>] [--verbose]\n')
+    for name, _, default in OPTIONS:
+      print(f'   {name: <16}default: {default}')
+    print('\n   latency is in seconds, errors is the share of failing responses,')
+    print('   workers and rate are the fetch configuration to measure')
+    return
+
+  standin = AplusStandIn(
+    options['exercises'],
+    options['submissions'],
+    options['persons'],
+    options['file-size'],
+    options['latency'],
+    options['errors']
+  )
+  url = standin.start()
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory() as work_dir:
+    os.chdir(work_dir)
+    try:
+      bench_config = Config()
+      bench_config.set_fetch({ 'workers': options['workers'], 'rate': options['rate'], 'start_rate': options['rate'] })
+      bench_config.set_sources([{
+        'type': 'aplus',
+        'url': f'{url}/api/v2/',
+        'token': 'benchmark',
+        'course_id': AplusStandIn.COURSE_ID,
+        'name': 'benchmark',
+      }])
+      print('{: <12}{: >9}{: >12}{: >9}{: >10}{: >12}'.format('phase', 'requests', 'bytes', 'time', 'req/s', 'bytes/s'))
+      total = { 'requests': 0, 'bytes': 0 }
+      total_seconds = 0
+      for name, run in PHASES:
+        before = standin.stats()
+        start = time.monotonic()
+        with open(os.devnull, 'w') as devnull:
+          with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            run(bench_config)
+        seconds = time.monotonic() - start
+        after = standin.stats()
+        stats = { k: after[k] - before[k] for k in after }
+        print(format_phase(name, stats, seconds))
+        total = after
+        total_seconds += seconds
+      print(format_phase('total', total, total_seconds))
+    finally:
+      os.chdir(cwd)
+      standin.stop()
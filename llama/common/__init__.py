@@ -1,14 +1,37 @@
 import sys
 from .input import *
+from .stores import *
 from .files import *
 from .dataframes import *
 from .series import *
+from .workers import *
+from .lines import *
 
 def require(condition, message='Cancelled', exit_code=0):
   if not condition:
     print(message)
     sys.exit(exit_code)
 
+def pop_option(args, name):
+  if name in args:
+    i = args.index(name)
+    require(i + 1 < len(args), f'Missing value for {name}')
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+  return None
+
+def pop_flag(args, name):
+  if name in args:
+    args.remove(name)
+    return True
+  return False
+
+def pop_workers_option(args):
+  workers = pop_option(args, '--workers')
+  require(workers is None or (workers.isdigit() and int(workers) > 0), 'Invalid number of workers')
+  return { 'workers': int(workers) } if workers else None
+
 def print_updated_line(line):
   sys.stdout.write('\r' + line)
   sys.stdout.flush()
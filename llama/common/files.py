@@ -1,22 +1,31 @@
 import os
 import json
+import importlib.util
 import pandas
+from .stores import STORAGE, COMPRESSION_EXT, item_store, store_item, root_compression
+
+TABLE_FORMATS = {
+  'csv': '.csv',
+  'parquet': '.parquet',
+  'feather': '.feather',
+}
 
 def path_to_file_name(path):
   return path if type(path) == str else os.path.join(*path)
 
 def mkdir(dir_name):
-  if not os.path.isdir(dir_name):
-    os.mkdir(dir_name)
+  # Parallel fetches may create the same directory
+  os.makedirs(dir_name, exist_ok=True)
 
 def ensure_dir(path):
-  if type(path) != str:
-    p = path[0]
-    for i in range(0, len(path) - 1):
-      mkdir(p)
-      p = os.path.join(p, path[i + 1])
+  if type(path) != str and len(path) > 1:
+    mkdir(os.path.join(*path[:-1]))
 
 def read_any(path, txt=False):
+  store, key = item_store(path)
+  if not store is None:
+    data = store.read(key)
+    return data.decode() if txt and not data is None else data
   file_name = path_to_file_name(path)
   if not os.path.isfile(file_name):
     return None
@@ -24,6 +33,10 @@ def read_any(path, txt=False):
     return f.read()
 
 def write_any(path, data, txt=False):
+  store, key = item_store(path)
+  if not store is None:
+    store_item(store, key, data.encode() if txt else data)
+    return
   ensure_dir(path)
   with open(path_to_file_name(path), 'w' if txt else 'wb') as f:
     f.write(data)
@@ -50,3 +63,98 @@ def read_csv(path):
 def write_csv(path, data):
   ensure_dir(path)
   data.to_csv(path_to_file_name(path), index=False)
+
+def table_format_available(fmt):
+  return fmt == 'csv' or (fmt in TABLE_FORMATS and not importlib.util.find_spec('pyarrow') is None)
+
+def table_exts(fmt):
+  # Columnar formats compress internally, csv files as a whole
+  ext = TABLE_FORMATS[fmt]
+  return [ext] + ([ext + c for c in COMPRESSION_EXT.values()] if fmt == 'csv' else [])
+
+def split_table_ext(file_name):
+  for fmt in TABLE_FORMATS:
+    for ext in reversed(table_exts(fmt)):
+      if file_name.endswith(ext):
+        return file_name[:-len(ext)], fmt
+  return file_name, None
+
+def table_compression(path):
+  return root_compression(path[0]) if type(path) != str else (None, None)
+
+def table_file_name(path, fmt=None):
+  fmt = fmt or STORAGE['tables']
+  base, _ = split_table_ext(path_to_file_name(path))
+  codec, _ = table_compression(path)
+  return base + TABLE_FORMATS[fmt] + (COMPRESSION_EXT[codec] if codec and fmt == 'csv' else '')
+
+def find_table_file(path):
+  base, ext_fmt = split_table_ext(path_to_file_name(path))
+  for fmt in [STORAGE['tables'], ext_fmt] + list(TABLE_FORMATS):
+    for ext in table_exts(fmt) if fmt else []:
+      if os.path.isfile(base + ext):
+        return base + ext, fmt
+  return None, None
+
+def read_table(path):
+  file_name, fmt = find_table_file(path)
+  if file_name is None:
+    return None
+  if fmt == 'parquet':
+    return pandas.read_parquet(file_name)
+  if fmt == 'feather':
+    return pandas.read_feather(file_name)
+  return pandas.read_csv(file_name)
+
+def write_table(path, data, fmt=None):
+  fmt = fmt or STORAGE['tables']
+  ensure_dir(path)
+  file_name = table_file_name(path, fmt)
+  codec, level = table_compression(path)
+  if fmt == 'csv':
+    data.to_csv(file_name, index=False, compression=csv_compression(codec, level))
+  else:
+    try:
+      write_columnar(file_name, fmt, data, codec, level)
+    except (ValueError, TypeError):
+      # Arrow requires one type per column
+      write_columnar(file_name, fmt, stringify_mixed_columns(data), codec, level)
+  base, _ = split_table_ext(file_name)
+  for other in TABLE_FORMATS:
+    for ext in table_exts(other):
+      if base + ext != file_name and os.path.isfile(base + ext):
+        os.remove(base + ext)
+  return file_name
+
+def csv_compression(codec, level):
+  if codec is None:
+    return None
+  if level is None:
+    return codec
+  return { 'method': codec, 'compresslevel' if codec == 'gzip' else 'level': level }
+
+def write_columnar(file_name, fmt, data, codec=None, level=None):
+  options = {} if level is None else { 'compression_level': level }
+  if fmt == 'parquet':
+    data.to_parquet(file_name, index=False, compression=codec or 'snappy', **options)
+  elif codec == 'zstd':
+    data.reset_index(drop=True).to_feather(file_name, compression=codec, **options)
+  else:
+    # Feather supports only lz4 and zstd, lz4 is the default
+    data.reset_index(drop=True).to_feather(file_name)
+
+def stringify_mixed_columns(data):
+  data = data.copy()
+  for c in data.columns:
+    if data[c].dtype == object and not pandas.api.types.infer_dtype(data[c], skipna=True) in ('string', 'empty'):
+      data[c] = data[c].map(lambda v: v if v is None or v != v else str(v))
+  return data
+
+def append_table(path, data):
+  file_name, fmt = find_table_file(path)
+  if fmt == 'csv' and file_name == table_file_name(path):
+    # Compressed streams can be concatenated
+    codec, level = table_compression(path)
+    data.to_csv(file_name, mode='a', header=False, index=False, compression=csv_compression(codec, level))
+  else:
+    write_table(path, pandas.concat([read_table(path), data], ignore_index=True))
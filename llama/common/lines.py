@@ -0,0 +1,76 @@
+import os
+import json
+import functools
+import collections
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+# The faster orjson decoder is used when it is installed
+if importlib.util.find_spec('orjson') is None:
+  loads_json = json.loads
+else:
+  import orjson
+  loads_json = orjson.loads
+
+LINE_CHUNK_BYTES = 8 * 1024 * 1024
+PARSE = { 'workers': None }
+
+def configure_parse_workers(workers):
+  # Worker processes of a pool set 1 to parse sequentially instead of nesting pools
+  PARSE['workers'] = workers
+
+def complete_lines_end(file_name, start=0):
+  # Offset after the last line break, a line that is still being written is excluded
+  size = os.path.getsize(file_name)
+  with open(file_name, 'rb') as f:
+    end = size
+    while end > start:
+      block_start = max(start, end - 65536)
+      f.seek(block_start)
+      i = f.read(end - block_start).rfind(b'\n')
+      if i >= 0:
+        return block_start + i + 1
+      end = block_start
+  return start
+
+def line_ranges(file_name, chunk_bytes=LINE_CHUNK_BYTES, start=0, end=None):
+  # Byte ranges that end on a line break
+  size = os.path.getsize(file_name) if end is None else end
+  with open(file_name, 'rb') as f:
+    while start < size:
+      f.seek(min(start + chunk_bytes, size))
+      f.readline()
+      end = min(f.tell(), size)
+      yield start, end
+      start = end
+
+def read_line_range(file_name, start, end):
+  with open(file_name, 'rb') as f:
+    f.seek(start)
+    return [line for line in f.read(end - start).splitlines() if line.strip()]
+
+def parse_line_range(parse, file_name, start, end):
+  return [parse(line) for line in read_line_range(file_name, start, end)]
+
+def parse_ranges(file_name, parse_range, workers=None, chunk_bytes=LINE_CHUNK_BYTES, start=0, end=None):
+  # Parses byte ranges of a file in order, large files in a process pool
+  workers = workers or PARSE['workers'] or os.cpu_count() or 1
+  end = os.path.getsize(file_name) if end is None else end
+  if workers <= 1 or end - start <= chunk_bytes:
+    for start, end in line_ranges(file_name, chunk_bytes, start, end):
+      yield parse_range(file_name, start, end)
+    return
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = collections.deque()
+    for start, end in line_ranges(file_name, chunk_bytes, start, end):
+      pending.append(pool.submit(parse_range, file_name, start, end))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+def parse_lines(file_name, parse=loads_json, workers=None, chunk_bytes=LINE_CHUNK_BYTES, start=0, end=None):
+  # Parses the lines of a file (or a byte range) in order
+  parse_range = functools.partial(parse_line_range, parse)
+  for lines in parse_ranges(file_name, parse_range, workers, chunk_bytes, start, end):
+    yield from lines
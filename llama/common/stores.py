@@ -0,0 +1,574 @@
+import io
+import os
+import gzip
+import json
+import shutil
+import sqlite3
+import importlib.util
+import hashlib
+import threading
+import time
+
+# Storage options of the working directory, see configure_storage
+STORAGE = {
+  'tables': 'csv',
+  'files': 'dirs',
+  'roots': [],
+  'compression': None,
+  'level': None,
+  'compressed_roots': [],
+  'manifest_roots': [],
+}
+
+# Compressed items and csv tables have the extension of the codec
+COMPRESSION_EXT = {
+  'gzip': '.gz',
+  'zstd': '.zst',
+}
+
+STORES = {}
+STORES_LOCK = threading.Lock()
+
+def configure_storage(options):
+  STORAGE.update(options)
+  close_stores()
+
+def close_stores():
+  with STORES_LOCK:
+    for store in STORES.values():
+      store.close()
+    STORES.clear()
+
+def storage_options():
+  return dict(STORAGE)
+
+def register_item_root(root):
+  if not root in STORAGE['roots']:
+    STORAGE['roots'] = STORAGE['roots'] + [root]
+
+def compression_available(codec):
+  return codec in ('gzip', None) or (codec == 'zstd' and not importlib.util.find_spec('zstandard') is None)
+
+def root_compression(root):
+  # The configured codec and level, if the root is compressed
+  if STORAGE['compression'] and root in STORAGE['compressed_roots']:
+    return STORAGE['compression'], STORAGE['level']
+  return None, None
+
+def compress(data, codec, level=None):
+  if codec == 'gzip':
+    # A fixed mtime keeps equal content byte-identical, gzip.compress takes it from 3.8 on
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9 if level is None else level, mtime=0) as f:
+      f.write(data)
+    return out.getvalue()
+  if codec == 'zstd':
+    import zstandard
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+  return data
+
+def decompress(data, codec):
+  if data is None:
+    return None
+  if codec == 'gzip':
+    return gzip.decompress(data)
+  if codec == 'zstd':
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+  return data
+
+def compressed_names(file_name):
+  # Candidate files of an item: (name, codec) for raw and each codec
+  return [(file_name, None)] + [(file_name + ext, codec) for codec, ext in COMPRESSION_EXT.items()]
+
+def strip_compression_ext(file_name):
+  for ext in COMPRESSION_EXT.values():
+    if file_name.endswith(ext):
+      return file_name[:-len(ext)]
+  return file_name
+
+def ensure_parent_dir(file_name):
+  dir_name = os.path.dirname(file_name)
+  if dir_name:
+    os.makedirs(dir_name, exist_ok=True)
+
+def read_file(file_name):
+  if not os.path.isfile(file_name):
+    return None
+  with open(file_name, 'rb') as f:
+    return f.read()
+
+def write_file(file_name, data):
+  ensure_parent_dir(file_name)
+  with open(file_name, 'wb') as f:
+    f.write(data)
+
+def read_compressed(file_name):
+  for name, codec in compressed_names(file_name):
+    if os.path.isfile(name):
+      return decompress(read_file(name), codec)
+  return None
+
+def write_compressed(file_name, data, codec=None, level=None):
+  target_name = file_name + COMPRESSION_EXT.get(codec, '')
+  write_file(target_name, compress(data, codec, level))
+  for name, _ in compressed_names(file_name):
+    if name != target_name and os.path.isfile(name):
+      os.remove(name)
+
+class ItemManifest:
+
+  # Append-only log of the stored items of a table: <root>/<table_dir>-manifest.jsonl,
+  # key -> size, hash, mtime and status, the last entry of a key wins.
+  # Only the manifest roots keep a log, so that it is not written into an export.
+
+  MANIFEST_SUFFIX = '-manifest.jsonl'
+  MANIFEST_JSONL = '{table_dir}' + MANIFEST_SUFFIX
+
+  def __init__(self, root, table_dir):
+    self.file_name = None
+    if root in STORAGE['manifest_roots']:
+      self.file_name = os.path.join(root, self.MANIFEST_JSONL.format(table_dir=table_dir))
+    self.entries = None
+    self.lock = threading.Lock()
+
+  def load(self):
+    with self.lock:
+      if self.entries is None:
+        self.entries = {}
+        if not self.file_name is None and os.path.isfile(self.file_name):
+          with open(self.file_name, 'r') as f:
+            for line in f:
+              try:
+                entry = json.loads(line)
+              except ValueError:
+                continue
+              self.entries[entry['key']] = entry
+      return self.entries
+
+  def get(self, key):
+    return self.load().get(key)
+
+  def record(self, key, data=None, size=None, h=None, status='stored'):
+    if self.file_name is None:
+      return
+    entry = {
+      'key': key,
+      'size': len(data) if not data is None else size,
+      'hash': BlobStore.hash(data) if not data is None else h,
+      'mtime': round(time.time(), 3),
+      'status': status,
+    }
+    entries = self.load()
+    with self.lock:
+      current = entries.get(key)
+      if current and all(current[k] == entry[k] for k in ('size', 'hash', 'status')):
+        return
+      ensure_parent_dir(self.file_name)
+      with open(self.file_name, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+      entries[key] = entry
+
+  def remove(self, key):
+    if not self.get(key) is None:
+      self.record(key, status='removed')
+
+  def stored_keys(self):
+    return [k for k, e in self.load().items() if e['status'] == 'stored']
+
+class DirStore:
+
+  # Items as files in directories: <root>/<table_dir>/<item_dir>/<name>
+
+  LAYOUT = 'dirs'
+
+  def __init__(self, root, table_dir):
+    self.root = root
+    self.table_dir = table_dir
+    self.codec, self.level = root_compression(root)
+    self.manifest = ItemManifest(root, table_dir)
+
+  @classmethod
+  def has_items(cls, root, table_dir):
+    return os.path.isdir(os.path.join(root, table_dir))
+
+  def file_name(self, key):
+    return os.path.join(self.root, self.table_dir, *key.split('/'))
+
+  def read(self, key):
+    return read_compressed(self.file_name(key))
+
+  def write(self, key, data):
+    write_compressed(self.file_name(key), data, self.codec, self.level)
+
+  def exists(self, key):
+    return any(os.path.isfile(n) for n, _ in compressed_names(self.file_name(key)))
+
+  def keys(self):
+    yield from DirStore.own_keys(self)
+
+  def own_keys(self):
+    top = os.path.join(self.root, self.table_dir)
+    if os.path.isdir(top):
+      for dir_name, _, files in os.walk(top):
+        rel = os.path.relpath(dir_name, top)
+        for f in files:
+          f = strip_compression_ext(f)
+          yield f if rel == '.' else '/'.join(rel.split(os.sep) + [f])
+
+  def own_items(self):
+    for key in list(self.own_keys()):
+      yield key, self.read(key)
+
+  def remove(self, key):
+    for file_name, _ in compressed_names(self.file_name(key)):
+      if os.path.isfile(file_name):
+        os.remove(file_name)
+
+  def clear(self):
+    for key in list(DirStore.own_keys(self)):
+      DirStore.remove(self, key)
+    remove_empty_dirs(os.path.join(self.root, self.table_dir))
+
+  def close(self):
+    pass
+
+class BlobStore(DirStore):
+
+  # Content-addressed blobs shared by the tables of a root: <root>/blobs/<hash>,
+  # and an append-only index of item references per table: <root>/<table_dir>-blobs.jsonl.
+  # Items that are not in the index are resolved from the directory layout.
+
+  LAYOUT = 'blobs'
+  BLOB_DIR = 'blobs'
+  INDEX_SUFFIX = '-blobs.jsonl'
+  INDEX_JSONL = '{table_dir}' + INDEX_SUFFIX
+
+  def __init__(self, root, table_dir):
+    super().__init__(root, table_dir)
+    self.index_name = os.path.join(root, self.INDEX_JSONL.format(table_dir=table_dir))
+    self.index = None
+    self.lock = threading.Lock()
+
+  @classmethod
+  def has_items(cls, root, table_dir):
+    return os.path.isfile(os.path.join(root, cls.INDEX_JSONL.format(table_dir=table_dir)))
+
+  @staticmethod
+  def hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+  def blob_name(self, h):
+    return os.path.join(self.root, self.BLOB_DIR, h[:2], h[2:])
+
+  def load_index(self):
+    with self.lock:
+      if self.index is None:
+        self.index = {}
+        if os.path.isfile(self.index_name):
+          with open(self.index_name, 'r') as f:
+            for line in f:
+              try:
+                entry = json.loads(line)
+              except ValueError:
+                continue
+              if entry['hash'] is None:
+                self.index.pop(entry['key'], None)
+              else:
+                self.index[entry['key']] = entry['hash']
+      return self.index
+
+  def add_reference(self, key, h):
+    index = self.load_index()
+    with self.lock:
+      if index.get(key) != h:
+        ensure_parent_dir(self.index_name)
+        with open(self.index_name, 'a') as f:
+          f.write(json.dumps({ 'key': key, 'hash': h }) + '\n')
+        if h is None:
+          index.pop(key, None)
+        else:
+          index[key] = h
+
+  def reference(self, key):
+    return self.load_index().get(key)
+
+  def find_blob(self, h):
+    for file_name, codec in compressed_names(self.blob_name(h)):
+      if os.path.isfile(file_name):
+        return file_name, codec
+    return None, None
+
+  def read(self, key):
+    h = self.reference(key)
+    if h is None:
+      return super().read(key)
+    return read_compressed(self.blob_name(h))
+
+  def write(self, key, data):
+    h = self.hash(data)
+    blob_file, codec = self.find_blob(h)
+    if blob_file is None or codec != self.codec:
+      blob_name = self.blob_name(h) + COMPRESSION_EXT.get(self.codec, '')
+      tmp_name = f'{blob_name}.{threading.get_ident()}.tmp'
+      write_file(tmp_name, compress(data, self.codec, self.level))
+      os.replace(tmp_name, blob_name)
+      for other_name, _ in compressed_names(self.blob_name(h)):
+        if other_name != blob_name and os.path.isfile(other_name):
+          os.remove(other_name)
+    self.add_reference(key, h)
+    super().remove(key)
+
+  def exists_blob(self, h):
+    return not self.find_blob(h)[0] is None
+
+  def link(self, key, source, source_key):
+    # Shares the blob of an item in another blob store without reading it
+    h = source.reference(source_key)
+    source_name, codec = (None, None) if h is None else source.find_blob(h)
+    if source_name is None or codec != self.codec:
+      return False
+    if not self.exists_blob(h):
+      blob_name = self.blob_name(h) + COMPRESSION_EXT.get(codec, '')
+      ensure_parent_dir(blob_name)
+      try:
+        os.link(source_name, blob_name)
+      except OSError:
+        shutil.copyfile(source_name, blob_name)
+    self.add_reference(key, h)
+    return True
+
+  def exists(self, key):
+    return not self.reference(key) is None or super().exists(key)
+
+  def keys(self):
+    index = self.load_index()
+    yield from index.keys()
+    for key in super().keys():
+      if not key in index:
+        yield key
+
+  def own_keys(self):
+    yield from list(self.load_index().keys())
+
+  def remove(self, key):
+    if not self.reference(key) is None:
+      self.add_reference(key, None)
+    super().remove(key)
+
+  def clear(self):
+    # Blobs may be shared, see remove_unreferenced_blobs
+    with self.lock:
+      if os.path.isfile(self.index_name):
+        os.remove(self.index_name)
+      self.index = None
+
+class PackedStore(DirStore):
+
+  # Items packed in one SQLite file per table: <root>/<table_dir>.sqlite,
+  # to avoid a directory and a file per item on slow file systems.
+  # Items that are not packed are resolved from the directory layout.
+
+  LAYOUT = 'packed'
+  PACKED_SQLITE = '{table_dir}.sqlite'
+
+  def __init__(self, root, table_dir):
+    super().__init__(root, table_dir)
+    self.packed_name = os.path.join(root, self.PACKED_SQLITE.format(table_dir=table_dir))
+    self.db = None
+    self.lock = threading.Lock()
+
+  @classmethod
+  def has_items(cls, root, table_dir):
+    return os.path.isfile(os.path.join(root, cls.PACKED_SQLITE.format(table_dir=table_dir)))
+
+  def connect(self, create=False):
+    if self.db is None and (create or os.path.isfile(self.packed_name)):
+      ensure_parent_dir(self.packed_name)
+      self.db = sqlite3.connect(self.packed_name, check_same_thread=False)
+      self.db.execute('CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, data BLOB, codec TEXT)')
+      if not 'codec' in (r[1] for r in self.db.execute('PRAGMA table_info(items)')):
+        self.db.execute('ALTER TABLE items ADD COLUMN codec TEXT')
+      self.db.commit()
+    return self.db
+
+  def query(self, sql, args=(), create=False):
+    with self.lock:
+      db = self.connect(create)
+      if db is None:
+        return []
+      rows = db.execute(sql, args).fetchall()
+      if db.in_transaction:
+        db.commit()
+      return rows
+
+  def read(self, key):
+    rows = self.query('SELECT data, codec FROM items WHERE key = ?', (key,))
+    if not rows:
+      return super().read(key)
+    return decompress(bytes(rows[0][0]), rows[0][1])
+
+  def write(self, key, data):
+    self.query(
+      'INSERT OR REPLACE INTO items (key, data, codec) VALUES (?, ?, ?)',
+      (key, compress(data, self.codec, self.level), self.codec),
+      create=True
+    )
+    super().remove(key)
+
+  def exists(self, key):
+    return bool(self.query('SELECT 1 FROM items WHERE key = ?', (key,))) or super().exists(key)
+
+  def keys(self):
+    packed = self.own_keys()
+    yield from packed
+    packed = set(packed)
+    for key in super().keys():
+      if not key in packed:
+        yield key
+
+  def own_keys(self):
+    return [r[0] for r in self.query('SELECT key FROM items ORDER BY rowid')]
+
+  def own_items(self):
+    # One sequential read of the packed items
+    with self.lock:
+      db = self.connect()
+      if db is None:
+        return
+      cursor = db.execute('SELECT key, data, codec FROM items ORDER BY rowid')
+      while True:
+        rows = cursor.fetchmany(100)
+        if not rows:
+          break
+        for key, data, codec in rows:
+          yield key, decompress(bytes(data), codec)
+
+  def remove(self, key):
+    self.query('DELETE FROM items WHERE key = ?', (key,))
+    super().remove(key)
+
+  def clear(self):
+    self.close()
+    if os.path.isfile(self.packed_name):
+      os.remove(self.packed_name)
+
+  def close(self):
+    with self.lock:
+      if not self.db is None:
+        self.db.close()
+        self.db = None
+
+STORE_TYPES = {
+  DirStore.LAYOUT: DirStore,
+  BlobStore.LAYOUT: BlobStore,
+  PackedStore.LAYOUT: PackedStore,
+}
+
+def open_store(root, table_dir, layout=None):
+  if layout is None:
+    layout = STORAGE['files']
+    for store_type in (PackedStore, BlobStore):
+      if store_type.has_items(root, table_dir):
+        layout = store_type.LAYOUT
+        break
+  return STORE_TYPES[layout](root, table_dir)
+
+def item_store(path):
+  # Item paths are (root, table_dir, item_dir, name) under a registered root
+  if type(path) == str or len(path) != 4 or not path[0] in STORAGE['roots']:
+    return None, None
+  root, table_dir, item_dir, name = path
+  with STORES_LOCK:
+    if not (root, table_dir) in STORES:
+      STORES[(root, table_dir)] = open_store(root, table_dir)
+    return STORES[(root, table_dir)], f'{item_dir}/{name}'
+
+def store_item(store, key, data):
+  store.write(key, data)
+  store.manifest.record(key, data)
+
+def item_exists(path):
+  # Answered from the manifest, items stored before it existed are checked from the store
+  store, key = item_store(path)
+  if store is None:
+    return os.path.isfile(os.path.join(*path) if type(path) != str else path)
+  entry = store.manifest.get(key)
+  if not entry is None:
+    return entry['status'] == 'stored'
+  return store.exists(key)
+
+def copy_item(source_path, target_path):
+  source, source_key = item_store(source_path)
+  target, target_key = item_store(target_path)
+  if isinstance(source, BlobStore) and isinstance(target, BlobStore):
+    if target.link(target_key, source, source_key):
+      entry = source.manifest.get(source_key) or {}
+      target.manifest.record(target_key, size=entry.get('size'), h=source.reference(source_key))
+      return True
+  data = source.read(source_key) if source else read_file(os.path.join(*source_path))
+  if data is None:
+    return False
+  if target:
+    store_item(target, target_key, data)
+  else:
+    write_file(os.path.join(*target_path), data)
+  return True
+
+def table_item_dirs(root):
+  # Table directories have item directories and no files at top level
+  names = set()
+  if os.path.isdir(root):
+    with os.scandir(root) as d:
+      for e in d:
+        if e.is_dir() and e.name != BlobStore.BLOB_DIR:
+          with os.scandir(e.path) as items:
+            if all(i.is_dir() for i in items):
+              names.add(e.name)
+        elif e.is_file() and e.name.endswith(BlobStore.INDEX_SUFFIX):
+          names.add(e.name[:-len(BlobStore.INDEX_SUFFIX)])
+        elif e.is_file() and e.name.endswith('.sqlite'):
+          names.add(e.name[:-len('.sqlite')])
+  return sorted(names)
+
+def migrate_items(root, table_dir, layout, recompress=False):
+  close_stores()
+  target = STORE_TYPES[layout](root, table_dir)
+  n = 0
+  if recompress and target.has_items(root, table_dir):
+    for key in list(target.own_keys()):
+      target.write(key, target.read(key))
+      n += 1
+  for source_type in STORE_TYPES.values():
+    if source_type.LAYOUT != layout and source_type.has_items(root, table_dir):
+      source = source_type(root, table_dir)
+      for key, data in source.own_items():
+        store_item(target, key, data)
+        n += 1
+      source.clear()
+      source.close()
+  target.close()
+  remove_empty_dirs(os.path.join(root, table_dir))
+  return n
+
+def remove_unreferenced_blobs(root):
+  referenced = set()
+  for table_dir in table_item_dirs(root):
+    if BlobStore.has_items(root, table_dir):
+      referenced.update(BlobStore(root, table_dir).load_index().values())
+  blob_dir = os.path.join(root, BlobStore.BLOB_DIR)
+  n = 0
+  if os.path.isdir(blob_dir):
+    for dir_name, _, files in os.walk(blob_dir):
+      for f in files:
+        if not os.path.basename(dir_name) + strip_compression_ext(f) in referenced:
+          os.remove(os.path.join(dir_name, f))
+          n += 1
+    remove_empty_dirs(blob_dir)
+  return n
+
+def remove_empty_dirs(top):
+  if os.path.isdir(top):
+    for dir_name, _, _ in os.walk(top, topdown=False):
+      if not os.listdir(dir_name):
+        os.rmdir(dir_name)
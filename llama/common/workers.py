@@ -0,0 +1,17 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+def ordered_map(fn, items, workers=1):
+  if workers is None or workers <= 1:
+    for i in items:
+      yield fn(i)
+    return
+  # Keep a bounded window of submitted work and yield results in input order
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    pending = collections.deque()
+    for i in items:
+      pending.append(pool.submit(fn, i))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
@@ -1,10 +1,11 @@
 from .types import get_sources_with_tables
 from .Filters import Filters
-from .common import require
+from .FetchScheduler import FetchScheduler
+from .common import require, pop_flag, pop_workers_option
 
-def get_filtered_table_rows(select_filter, config):
+def get_filtered_table_rows(select_filter, sources, config):
   fl = Filters(config.exclude)
-  for s in select_filter.filter(fl.filter(get_sources_with_tables(config))):
+  for s in select_filter.filter(fl.filter(sources)):
     for t in s['tables']:
       rows, _ = s['api'].fetch_rows(t, only_cache=True)
       if rows is None:
@@ -12,14 +13,48 @@ def get_filtered_table_rows(select_filter, config):
       else:
         yield s, t, rows
 
+def fetch_person_tables(fl, sources, include_personal):
+  # Tables that select persons are updated before the selection and without it
+  fetched = set()
+  for s, t in fl.person_tables(sources):
+    rows, _ = s['api'].fetch_rows(t, include_personal)
+    print(f'[{s["name"]}] {t["name"]}: {0 if rows is None else rows.shape[0]} rows')
+    fetched.add((s['id'], t['id']))
+  return fetched
+
+def without_tables(sources, keys):
+  selected = []
+  for s in sources:
+    tables = [t for t in s['tables'] if not (s['id'], t['id']) in keys]
+    if tables:
+      selected.append({ **s, 'tables': tables })
+  return selected
+
+def print_fetch_stats(sources):
+  for s in sources:
+    stats = s['api'].fetch_stats()
+    if stats['requests'] > 0:
+      print(
+        f'{s["name"]}: {stats["requests"]} requests over {stats["connections"]} connections,'
+        f' {stats["retries"]} retries'
+      )
+  if sources:
+    for host, state in sources[0]['api'].limiter.state().items():
+      print(f'{host}: throttled to {state["rate"]:.2f} requests/s with {state["workers"]} parallel')
+
 def command(args, config):
+  args = list(args)
+  fetch_options = pop_workers_option(args)
+  retry_failed = pop_flag(args, '--retry-failed')
   target = args[0] if len(args) > 0 else None
   if not target in ('rows', 'files', 'filesfix', 'meta'):
     print('Fetches learning data from sources\n')
-    print('usage: llama fetch <target> [<select>]\n')
+    print('usage: llama fetch <target> [--workers N] [--retry-failed] [<select>]\n')
     print('   target    rows     new table rows')
     print('             files    new file attachments for rows')
     print('             meta     new meta attachments for rows')
+    print('   workers   upper bound of parallel requests per source (default: 1)')
+    print('   retry     only retry files or meta that failed in previous fetches')
     print('   select    [-][source:](#table_id|partial_table_name)')
     return
   fls = Filters([], inclusive=True)
@@ -27,26 +62,32 @@ def command(args, config):
     select = Filters.parse(' '.join(args[1:]), columns=False)
     require(select, 'Invalid select pattern')
     fls.add([select])
+  sources = get_sources_with_tables(config, fetch_options)
+  failed = []
   if target == 'rows':
-    sources = get_sources_with_tables(config)
     fl = Filters(config.exclude)
-    persons = fl.person_select(sources, config.privacy == 'none') if fl.has_person_filters() else None
-    for s in fls.filter(fl.filter(sources)):
-      for t in s['tables']:
-        columns_rm = [c['key'] for c in t['columns_rm']] if 'columns_rm' in t else None
-        s['api'].fetch_rows(t, config.privacy == 'none', False, persons, columns_rm)
+    persons = None
+    fetched = set()
+    if fl.has_person_filters():
+      fetched = fetch_person_tables(fl, sources, config.privacy == 'none')
+      persons = fl.person_select(sources)
+    scheduler = FetchScheduler(fetch_options and fetch_options['workers'])
+    failed = scheduler.run(without_tables(fls.filter(fl.filter(sources)), fetched), config.privacy == 'none', persons)
   elif target in ('files', 'filesfix'):
-    for source, table, rows in get_filtered_table_rows(fls, config):
+    for source, table, rows in get_filtered_table_rows(fls, sources, config):
       for r in source['api'].fetch_files(
         table,
         rows,
         include_personal=config.privacy == 'none',
-        fix_privacy=target == 'filesfix'
+        fix_privacy=target == 'filesfix',
+        retry_failed=retry_failed
       ):
         if r['cached']:
           print(f'* Cached file {"/".join(r["path"])}')
   elif target == 'meta':
-    for source, table, rows in get_filtered_table_rows(fls, config):
-      for r in source['api'].fetch_meta(table, rows, config.privacy == 'none'):
+    for source, table, rows in get_filtered_table_rows(fls, sources, config):
+      for r in source['api'].fetch_meta(table, rows, config.privacy == 'none', retry_failed=retry_failed):
         if r['cached']:
           print(f'* Cached meta {"/".join(r["path"])}')
+  print_fetch_stats(sources)
+  require(not failed, f'Failed to fetch rows from: {", ".join(failed)}', 1)
@@ -1,6 +1,6 @@
 from .types import enumerate_sources
 from .operations import last_time
-from .common import count
+from .common import count, pop_workers_option
 from .Filters import Filters
 
 def format_source(i, name):
@@ -16,11 +16,13 @@ def print_sources(sources):
       print(format_table(t['id'], t['name'], t['columns']))
 
 def command(args, config):
+  args = list(args)
+  fetch_options = pop_workers_option(args)
   if args != [] and args != ['update']:
     print('Lists and updates available data tables and their fields\n')
-    print('usage: llama list [update]\n')
+    print('usage: llama list [update] [--workers N]\n')
   else:
-    for i, src, api in enumerate_sources(config):
+    for i, src, api in enumerate_sources(config, fetch_options):
       print(format_source(i, src['name']))
       tables, cached = api.list_tables(args != ['update'])
       if cached:
@@ -30,7 +32,7 @@ def command(args, config):
         rows, _ = api.fetch_rows(t, only_cache=True)
         rows_n = 0 if rows is None else rows.shape[0]
         if not rows is None and count(api.file_columns(t, rows)) > 0:
-          file_n = count(api.fetch_files(t, rows, only_cache=True))
+          file_n = sum(1 for r in api.fetch_files(t, rows, only_cache=True) if r['cached'])
           print(f'{rows_n} rows, {file_n} files, last {last_time(rows)}')
         elif rows_n > 0:
           print(f'{rows_n} rows, last {last_time(rows)}')
@@ -7,11 +7,13 @@ WEEKNUMBER_KEY = 'Weeknumber'
 HOUR_KEY = 'Hour'
 
 def ensure_column_types(rows):
+  # Typed table formats store the converted columns
   if not rows is None:
-    if TIME_KEY in rows:
+    if TIME_KEY in rows and not pandas.api.types.is_datetime64_any_dtype(rows[TIME_KEY]):
       rows[TIME_KEY] = pandas.to_datetime(rows[TIME_KEY])
-    if PERSON_KEY in rows:
+    if PERSON_KEY in rows and pandas.api.types.infer_dtype(rows[PERSON_KEY]) != 'string':
       rows[PERSON_KEY] = rows[PERSON_KEY].astype(str)
+  return rows
 
 def last_time(rows):
   return rows[TIME_KEY].max()
@@ -25,9 +27,13 @@ def filter_to_last_by_person(rows):
     .drop_duplicates(PERSON_KEY, keep='last', ignore_index=True)
 
 def person_has_columns_value(rows, columns, value, reverse=False):
-  for _, row in filter_to_last_by_person(rows).iterrows():
-    has_value = all(row[c['key']] == value for c in columns)
-    yield row[PERSON_KEY], not has_value if reverse else has_value
+  # Series of persons whether all columns of their last row have the value
+  last = rows.sort_values(by=TIME_KEY, kind='stable').groupby(PERSON_KEY, sort=False).tail(1)
+  has_value = last.reindex(columns=[c['key'] for c in columns]).eq(value).all(axis=1)
+  return pandas.Series(
+    (~has_value if reverse else has_value).to_numpy(),
+    index=last[PERSON_KEY].to_numpy()
+  )
 
 def append_discrete_time_columns(rows):
   iso = rows[TIME_KEY].dt.isocalendar()
@@ -0,0 +1,119 @@
+import os
+from .Config import STORAGE_DIR, EXPORT_DIR, EXPORT_INDEX_JSON
+from .operations import ensure_column_types
+from .common import (
+  require, read_json, write_json, read_table, write_table, pop_option, pop_flag,
+  split_table_ext, table_file_name, table_format_available, configure_storage,
+  compression_available, table_item_dirs, migrate_items, remove_unreferenced_blobs
+)
+
+FORMAT_TXT = {
+  'csv': 'Text tables, types are parsed on every read',
+  'parquet': 'Typed columnar tables (requires pyarrow)',
+  'feather': 'Typed columnar tables in Arrow IPC format (requires pyarrow)',
+}
+
+LAYOUT_TXT = {
+  'dirs': 'Files and meta in a directory per row',
+  'blobs': 'Files and meta stored once per content and referenced per row',
+  'packed': 'Files and meta packed in a single SQLite file per table',
+}
+
+COMPRESSION_TXT = {
+  'gzip': 'Compress files, meta and tables with gzip',
+  'zstd': 'Compress files, meta and tables with zstd (requires zstandard)',
+  'uncompressed': 'Store files, meta and tables uncompressed',
+}
+
+def table_files(dir, fmt):
+  if os.path.isdir(dir):
+    with os.scandir(dir) as d:
+      for e in d:
+        base, file_fmt = split_table_ext(e.name)
+        if e.is_file() and file_fmt and base.endswith(('-rows', '-events')):
+          path = (dir, e.name)
+          if file_fmt != fmt or table_file_name(path, fmt) != os.path.join(*path):
+            yield path
+
+def migrate_tables(dir, fmt):
+  for path in list(table_files(dir, fmt)):
+    write_table(path, ensure_column_types(read_table(path)), fmt)
+    print(f'Migrated {"/".join(path)}')
+
+def migrate_export_index(fmt):
+  index = read_json((EXPORT_DIR, EXPORT_INDEX_JSON))
+  for s in (index or {}).get('sources', []):
+    tables = read_json((EXPORT_DIR, s['index_file']))
+    for t in tables or []:
+      for key in ('data_file', 'events_file'):
+        if key in t:
+          file_name = table_file_name((EXPORT_DIR, t[key]), fmt)
+          t[key] = os.path.relpath(file_name, EXPORT_DIR).replace(os.sep, '/')
+    if tables:
+      write_json((EXPORT_DIR, s['index_file']), tables)
+
+def migrate_files(dir, layout, recompress=False):
+  for table_dir in table_item_dirs(dir):
+    n = migrate_items(dir, table_dir, layout, recompress)
+    if n > 0:
+      print(f'Migrated {n} items in {dir}/{table_dir}')
+  n = remove_unreferenced_blobs(dir)
+  if n > 0:
+    print(f'Removed {n} unreferenced blobs in {dir}')
+
+def migrate_all(storage, recompress=False):
+  for dir in (STORAGE_DIR, EXPORT_DIR):
+    migrate_tables(dir, storage['tables'])
+    migrate_files(dir, storage['files'], recompress)
+  migrate_export_index(storage['tables'])
+
+def print_usage(config):
+  print('Configures the storage of data tables and files in fetched and export\n')
+  print('usage: llama storage <format|layout|compression> [--level N] [--export]\n')
+  for title, options in (('format', FORMAT_TXT), ('layout', LAYOUT_TXT), ('compression', COMPRESSION_TXT)):
+    print(f'   {title}')
+    for key, txt in options.items():
+      print(f'   {key: <13}{txt}')
+  print('\n   --level N    Compression level, default depends on the codec')
+  print('   --export     Compress also the export directory')
+  print('\nExisting tables or files are migrated to the selected storage.')
+  s = config.storage
+  print(
+    f'Current: {s["tables"]} tables, files in {s["files"]}, '
+    f'{s["compression"] or "uncompressed"}{" including export" if s["compression"] and s["compress_export"] else ""}'
+  )
+
+def command(args, config):
+  args = list(args)
+  level = pop_option(args, '--level')
+  export = pop_flag(args, '--export')
+  if len(args) != 1:
+    print_usage(config)
+  elif args[0] in FORMAT_TXT:
+    fmt = args[0]
+    require(table_format_available(fmt), f'Install pyarrow to use {fmt}: python3 -m pip install pyarrow')
+    config.set_storage({ **config.storage, 'tables': fmt })
+    configure_storage(config.storage_roots())
+    migrate_all(config.storage)
+    print(f'Table storage set to: {fmt}')
+  elif args[0] in LAYOUT_TXT:
+    layout = args[0]
+    config.set_storage({ **config.storage, 'files': layout })
+    configure_storage(config.storage_roots())
+    migrate_all(config.storage)
+    print(f'File storage set to: {layout}')
+  elif args[0] in COMPRESSION_TXT:
+    codec = args[0] if args[0] != 'uncompressed' else None
+    require(compression_available(codec), f'Install zstandard to use {codec}: python3 -m pip install zstandard')
+    require(level is None or level.isdigit(), 'Invalid compression level')
+    config.set_storage({
+      **config.storage,
+      'compression': codec,
+      'level': None if level is None else int(level),
+      'compress_export': export,
+    })
+    configure_storage(config.storage_roots())
+    migrate_all(config.storage, recompress=True)
+    print(f'Compression set to: {args[0]}')
+  else:
+    print('Not a storage format, layout or compression')
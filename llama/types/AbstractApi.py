@@ -1,25 +1,91 @@
 import os
 import time
-import io
 import json
+import threading
 import requests
 import pandas
-from ..Config import STORAGE_DIR, TIME_KEY, PERSON_KEY
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .AdaptiveThrottle import AdaptiveThrottle
+from .FetchJournal import FetchJournal
+from .FetchedItem import FetchedItem
+from ..Config import STORAGE_DIR, TIME_KEY, PERSON_KEY, FETCH_DEFAULTS
 from ..operations import ensure_column_types
-from ..common import read_json, write_json, read_csv, write_csv, read_any, write_any
+from ..common import (
+  read_json, write_json, read_table, write_table, append_table, find_table_file,
+  table_file_name, read_any, write_any, item_exists, ordered_map
+)
 
 class AbstractApi:
 
   TABLE_LIST_JSON = '{source_id}-tables.json'
   TABLE_CSV = '{source_id}-{table_id}-rows.csv'
   TABLE_DIR = '{source_id}-{table_id}'
+  TABLE_JOURNAL = '{source_id}-{table_id}-journal.jsonl'
   ITEM_DIR = '{user_id}-{time}'
   META_JSON = 'meta.json'
 
-  REQUEST_DELAY = 1 #sec
+  RETRY_STATUS = (500, 502, 504)
+  FETCH_POOL = 'thread'
+  CSV_CHUNK_ROWS = 10000
+  LAZY_CONTENT = object()
+  REFETCH_ROWS = object()
 
   def __init__(self, source_id):
     self.source_id = source_id
+    self.row_commits = {}
+    self.configure_fetch(FETCH_DEFAULTS)
+
+  def configure_fetch(self, options, limiter=None):
+    self.fetch_options = { **FETCH_DEFAULTS, **options }
+    self.limiter = limiter or AdaptiveThrottle(self.fetch_options)
+    self.session = self.create_session()
+    self.stats_lock = threading.Lock()
+    self.request_count = 0
+    self.retry_count = 0
+
+  def __getstate__(self):
+    # Sessions, locks and the shared limiter are recreated in a worker process
+    state = self.__dict__.copy()
+    for key in ('limiter', 'session', 'stats_lock'):
+      del state[key]
+    state['row_commits'] = {}
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.configure_fetch(self.fetch_options)
+
+  def create_session(self):
+    adapter = HTTPAdapter(
+      pool_maxsize=max(1, self.fetch_options['workers']),
+      max_retries=Retry(
+        total=self.fetch_options['retries'],
+        backoff_factor=self.fetch_options['backoff'],
+        status_forcelist=self.RETRY_STATUS,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+      ),
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+  def fetch_stats(self):
+    connections = 0
+    for adapter in set(self.session.adapters.values()):
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools.get(key)
+        if not pool is None:
+          connections += pool.num_connections
+    return {
+      'requests': self.request_count,
+      'connections': connections,
+      'retries': self.retry_count,
+    }
 
   def list_tables(self, try_cache=True, only_cache=False):
     return self.cached_json_or_fetch(
@@ -30,7 +96,8 @@ class AbstractApi:
     )
   
   def fetch_rows(self, table, include_personal=False, only_cache=False, select_persons=None, exclude_columns=None):
-    rows, cached = self.cached_csv_or_fetch(
+    self.row_commits.pop(table['id'], None)
+    rows, cached = self.cached_table_or_fetch(
       lambda: self.fetch_rows_csv(table, None, include_personal, select_persons, exclude_columns),
       self.table_csv_name(table['id']),
       True,
@@ -39,49 +106,132 @@ class AbstractApi:
     if cached:
       if not only_cache:
         new_rows = self.fetch_rows_csv(table, rows, include_personal, select_persons, exclude_columns)
-        if not new_rows is None:
-          write_csv(self.table_csv_name(table['id']), new_rows)
-          rows = new_rows
-          self.fetch_delay()
-    else:
-      self.fetch_delay()
+        if new_rows is self.REFETCH_ROWS:
+          rows = self.refetch_rows(table, rows, include_personal, select_persons, exclude_columns)
+        elif not new_rows is None:
+          rows = self.append_rows(table, rows, new_rows)
+    if not only_cache:
+      self.commit_rows(table)
     ensure_column_types(rows)
     return rows, cached
 
-  def fetch_files(self, table, rows, include_personal=False, only_cache=False, fix_privacy=False):
+  def after_rows_stored(self, table, commit):
+    # Fetch state that must only advance once the fetched rows are stored
+    self.row_commits.setdefault(table['id'], []).append(commit)
+
+  def commit_rows(self, table):
+    for commit in self.row_commits.pop(table['id'], []):
+      commit()
+
+  def append_rows(self, table, rows, new_rows):
+    # Returns the typed rows exactly as they were stored
+    path = self.table_csv_name(table['id'])
+    rows = ensure_column_types(rows)
+    if set(new_rows.columns) <= set(rows.columns):
+      new_rows = ensure_column_types(new_rows.reindex(columns=rows.columns))
+      append_table(path, new_rows)
+      return pandas.concat([rows, new_rows], ignore_index=True)
+    rows = pandas.concat([rows, ensure_column_types(new_rows)], ignore_index=True)
+    write_table(path, rows)
+    return rows
+
+  def refetch_rows(self, table, rows, include_personal, select_persons, exclude_columns):
+    new_rows = self.fetch_rows_csv(table, None, include_personal, select_persons, exclude_columns)
+    if new_rows is None:
+      new_rows = rows.iloc[0:0]
+    write_table(self.table_csv_name(table['id']), ensure_column_types(new_rows))
+    return new_rows
+
+  def fetch_files(self, table, rows, include_personal=False, only_cache=False, fix_privacy=False, workers=None, retry_failed=False):
     file_cols = self.file_columns(table, rows)
-    table_dir = self.table_dir_name(table['id'])
-    for _, row in rows.iterrows():
-      item_dir = self.item_dir_name(row)
-      for c in file_cols:
-        path = (STORAGE_DIR, table_dir, item_dir, c)
-        content, cached = self.cached_or_fetch(
-          lambda: read_any(path),
-          lambda: self.fetch_file(table, row, c, include_personal),
-          lambda r: write_any(path, r),
-          True,
-          only_cache
-        )
-        if fix_privacy and cached:
-          write_any(path, self.fix_file_privacy(table, row, c, content))
-        if not content is None and not cached:
-          self.fetch_delay()
-        yield { 'row': row, 'col': c, 'path': path, 'content': content, 'cached': cached }
 
-  def fetch_meta(self, table, rows, include_personal=False, only_cache=False):
-    table_dir = self.table_dir_name(table['id'])
-    for _, row in rows.iterrows():
-      item_dir = self.item_dir_name(row)
-      path = (STORAGE_DIR, table_dir, item_dir, self.META_JSON)
-      content, cached = self.cached_json_or_fetch(
+    def fetch_item(row, c, path):
+      if not fix_privacy and item_exists(path):
+        return self.LAZY_CONTENT, True
+      content, cached = self.cached_or_fetch(
+        lambda: read_any(path),
+        lambda: self.fetch_file(table, row, c, include_personal),
+        lambda r: write_any(path, r),
+        True,
+        only_cache
+      )
+      if fix_privacy and cached:
+        write_any(path, self.fix_file_privacy(table, row, c, content))
+      return content, cached
+
+    yield from self.fetch_items(
+      table,
+      ((row, c) for _, row in rows.iterrows() for c in file_cols),
+      fetch_item,
+      read_any,
+      not (only_cache or fix_privacy),
+      retry_failed,
+      workers
+    )
+
+  def fetch_meta(self, table, rows, include_personal=False, only_cache=False, workers=None, retry_failed=False):
+
+    def fetch_item(row, c, path):
+      if item_exists(path):
+        return self.LAZY_CONTENT, True
+      return self.cached_json_or_fetch(
         lambda: self.fetch_meta_json(table, row, include_personal),
         path,
         True,
         only_cache
       )
-      if not content is None and not cached:
-        self.fetch_delay()
-      yield { 'row': row, 'path': path, 'content': content, 'cached': cached }
+
+    yield from self.fetch_items(
+      table,
+      ((row, self.META_JSON) for _, row in rows.iterrows()),
+      fetch_item,
+      read_json,
+      not only_cache,
+      retry_failed,
+      workers
+    )
+
+  def fetch_items(self, table, items, fetch_item, read_item, journal=False, retry_failed=False, workers=None):
+    table_dir = self.table_dir_name(table['id'])
+    log = FetchJournal(self.table_journal_name(table['id'])) if journal else None
+    skipped = 0
+
+    def pending_items():
+      nonlocal skipped
+      for row, c in items:
+        key = (self.item_dir_name(row), c)
+        if log is None or log.pending(key, retry_failed):
+          yield key, row
+        else:
+          skipped += 1
+
+    def map_item(item):
+      key, row = item
+      path = (STORAGE_DIR, table_dir) + key
+      try:
+        content, cached = fetch_item(row, key[1], path)
+      except (requests.RequestException, ValueError, OSError) as e:
+        if log is None:
+          raise
+        print(f'* Failed {"/".join(path)}: {e}')
+        log.record(key, False)
+        content, cached = None, False
+      else:
+        if not log is None:
+          log.record(key, True)
+      item = FetchedItem(lambda: read_item(path), row=row, col=key[1], path=path, cached=cached)
+      if content is not self.LAZY_CONTENT:
+        item['content'] = content
+      return item
+
+    # Requests are throttled in fetch by the per host limiter
+    try:
+      yield from ordered_map(map_item, pending_items(), workers or self.fetch_options['workers'])
+    finally:
+      if not log is None:
+        log.close()
+        if skipped > 0:
+          print(f'* Journal {table["name"]}: skipped {skipped} {"completed" if not retry_failed else "not failed"} items')
 
   def export_rows(self, table, rows, person_map, metas=False, volatile_columns=None):
     data = self.drop_for_export(table, rows, volatile_columns)
@@ -102,12 +252,18 @@ class AbstractApi:
       ]
     return data
 
+  def sidecar_tables(self, table):
+    # Additional tables stored at fetch as (index key, path)
+    return []
+
   def fetch_tables_json(self):
     raise NotImplementedError()
 
   def fetch_rows_csv(self, table, old_rows, include_personal, select_persons, exclude_columns):
     # MUST use default keys if appropriate columns: TIME_KEY, PERSON_KEY, GRADE_KEY
     # Should optimize the queries to extend previous data, if possible.
+    # Given old_rows, return only the new rows to append or None.
+    # Return REFETCH_ROWS when old_rows can not be extended and must be replaced.
     raise NotImplementedError()
   
   def fetch_meta_json(self, table, row, include_personal):
@@ -136,6 +292,23 @@ class AbstractApi:
       self.TABLE_CSV.format(source_id=self.source_id, table_id=table_id),
     )
 
+  def table_file_name(self, table_id):
+    file_name, _ = find_table_file(self.table_csv_name(table_id))
+    return file_name or table_file_name(self.table_csv_name(table_id))
+
+  def table_version(self, table_id):
+    file_name, _ = find_table_file(self.table_csv_name(table_id))
+    if file_name is None:
+      return None
+    stat = os.stat(file_name)
+    return [os.path.basename(file_name), stat.st_size, stat.st_mtime_ns]
+
+  def table_journal_name(self, table_id):
+    return (
+      STORAGE_DIR,
+      self.TABLE_JOURNAL.format(source_id=self.source_id, table_id=table_id),
+    )
+
   def table_dir_name(self, table_id):
     return self.TABLE_DIR.format(source_id=self.source_id, table_id=table_id)
 
@@ -145,18 +318,79 @@ class AbstractApi:
       time=row[TIME_KEY].strftime(r'%Y%m%d%H%M%S')
     )
 
-  def fetch_delay(self):
-    time.sleep(self.REQUEST_DELAY)
-
-  def fetch(self, url, headers={}):
-    print(f'> GET {url}')
-    return requests.get(url, headers=headers)
+  def fetch(self, url, headers=None, stream=False):
+    # Transient errors are retried by the session, throttling responses here
+    for attempt in range(self.fetch_options['retries'] + 1):
+      if attempt > 0:
+        response.close()
+      self.limiter.acquire(url)
+      print(f'> GET {url}')
+      start = time.monotonic()
+      try:
+        response = self.session.get(
+          url,
+          headers=headers,
+          stream=stream,
+          timeout=self.fetch_options['timeout']
+        )
+      except requests.RequestException:
+        self.limiter.release(url, None, time.monotonic() - start)
+        raise
+      self.limiter.release(
+        url,
+        response.status_code,
+        time.monotonic() - start,
+        response.headers.get('Retry-After')
+      )
+      retries = response.raw.retries if response.raw else None
+      with self.stats_lock:
+        self.request_count += 1
+        self.retry_count += (len(retries.history) if retries else 0) + (1 if attempt > 0 else 0)
+      if not response.status_code in AdaptiveThrottle.THROTTLE_STATUS:
+        break
+    return response
 
   def fetch_json(self, url):
-    return json.loads(self.fetch(url).text)
+    response = self.fetch(url)
+    response.raise_for_status()
+    return json.loads(response.text)
+
+  def fetch_json_revalidated(self, url, path):
+    cached = read_json(path)
+    headers = {}
+    if cached:
+      if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+      if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    response = self.fetch(url, headers=headers)
+    if response.status_code == 304 and cached:
+      return cached['data']
+    response.raise_for_status()
+    data = json.loads(response.text)
+    if 'ETag' in response.headers or 'Last-Modified' in response.headers:
+      write_json(path, {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'data': data,
+      })
+    return data
   
-  def fetch_csv(self, url):
-    return pandas.read_csv(io.StringIO(self.fetch(url).text))
+  def fetch_csv(self, url, select=None):
+    # Parses the response body in chunks, optionally reducing each chunk before it is kept
+    response = self.fetch(url, stream=True)
+    with response:
+      response.raise_for_status()
+      response.raw.decode_content = True
+      chunks = [
+        chunk if select is None else select(chunk)
+        for chunk in pandas.read_csv(
+          response.raw,
+          chunksize=self.CSV_CHUNK_ROWS,
+          encoding=response.encoding or 'utf-8'
+        )
+      ]
+    return pandas.concat(chunks, ignore_index=True)
 
   def cached_json_or_fetch(self, fetch, path, try_cache=True, only_cache=False):
     return self.cached_or_fetch(
@@ -167,11 +401,11 @@ class AbstractApi:
       only_cache
     )
 
-  def cached_csv_or_fetch(self, fetch, path, try_cache=True, only_cache=False):
+  def cached_table_or_fetch(self, fetch, path, try_cache=True, only_cache=False):
     return self.cached_or_fetch(
-      lambda: read_csv(path),
+      lambda: read_table(path),
       lambda: fetch(),
-      lambda r: write_csv(path, r),
+      lambda r: write_table(path, ensure_column_types(r)),
       try_cache,
       only_cache
     )
@@ -1,22 +1,57 @@
+import math
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from .AbstractApi import AbstractApi
+from ..common import ordered_map
 
 class AbstractDjangoApi(AbstractApi):
 
   def __init__(self, source_id, token):
-    super().__init__(source_id)
     self.token = token
+    super().__init__(source_id)
 
-  def fetch(self, url, headers={}):
-    headers['Authorization'] = f'Token {self.token}'
-    return super().fetch(url, headers=headers)
+  def create_session(self):
+    session = super().create_session()
+    session.headers['Authorization'] = f'Token {self.token}'
+    return session
 
   def get_paged_json(self, url):
-    results = []
-    next = url
-    while next:
-      response = self.fetch_json(next)
-      results.extend(response['results'])
-      next = response['next']
-      if next:
-        self.fetch_delay()
-    return results
+    return list(self.iter_paged_json(url))
+
+  def iter_paged_json(self, url):
+    response = self.fetch_json(url)
+    yield from response['results']
+    next = response['next']
+    pages = self.remaining_page_urls(next, response.get('count'), len(response['results']))
+    if pages is None:
+      while next:
+        response = self.fetch_json(next)
+        yield from response['results']
+        next = response['next']
+    else:
+      # Page requests are throttled in fetch by the per host limiter
+      for response in ordered_map(self.fetch_json, pages, self.fetch_options['workers']):
+        yield from response['results']
+
+  @staticmethod
+  def remaining_page_urls(next, count, page_size):
+    # Supports the limit-offset and page number paginations of Django REST framework
+    if not next or count is None or page_size == 0:
+      return None
+    parts = urlsplit(next)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    params = dict(query)
+
+    def page_url(key, value):
+      q = [(k, str(value) if k == key else v) for k, v in query]
+      return urlunsplit(parts._replace(query=urlencode(q)))
+
+    try:
+      if 'offset' in params:
+        limit = int(params.get('limit', page_size))
+        return [page_url('offset', o) for o in range(int(params['offset']), count, limit)]
+      if 'page' in params:
+        last = math.ceil(count / page_size)
+        return [page_url('page', p) for p in range(int(params['page']), last + 1)]
+    except ValueError:
+      pass
+    return None
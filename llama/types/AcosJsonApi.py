@@ -1,13 +1,182 @@
 import os
 import re
-import json
-import datetime
+import gzip
+import heapq
+import hashlib
+import functools
+import numpy
 import pandas
 from .AbstractApi import AbstractApi
-from ..Config import TIME_KEY, GRADE_KEY, PERSON_KEY
+from ..Config import STORAGE_DIR, TIME_KEY, GRADE_KEY, PERSON_KEY
+from ..common import (
+  read_json, write_json, write_table, append_table, find_table_file,
+  line_ranges, read_line_range, parse_ranges, complete_lines_end, loads_json
+)
+
+LOG_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+MERGE_CHUNK_BYTES = 1024 * 1024
+SUBMISSION_KEY = 'Submission'
+EVENT_COLUMNS = {
+  SUBMISSION_KEY: 'int64',
+  'type': 'object',
+  'time': 'Int64',
+  'action': 'object',
+  'start_row': 'Int64',
+  'start_column': 'Int64',
+  'end_row': 'Int64',
+  'end_column': 'Int64',
+  'lines': 'object',
+  'qlc_type': 'object',
+  'answer_type': 'object',
+  'answer_text': 'object',
+  'correct': 'boolean',
+}
+
+def decode_json_batch(values):
+  return loads_json(b'[' + b','.join(values) + b']')
+
+def parse_log_lines(select_persons, lines):
+  # Splits the tab separated fields to columns, payloads of selected persons are decoded in one batch
+  times, payloads, protocols = [], [], []
+  for line in lines:
+    time_s, payload_s, protocol_s = line.split(b'\t')
+    times.append(time_s)
+    payloads.append(payload_s)
+    protocols.append(protocol_s)
+  persons = [str(p.get('uid')) for p in decode_json_batch(protocols)]
+  if not select_persons is None:
+    keep = [i for i, p in enumerate(persons) if p in select_persons]
+    times = [times[i] for i in keep]
+    payloads = [payloads[i] for i in keep]
+    persons = [persons[i] for i in keep]
+  return times, persons, decode_json_batch(payloads)
+
+def parse_log_range(select_persons, file_name, start, end):
+  return parse_log_lines(select_persons, read_line_range(file_name, start, end))
+
+def log_segment_lines(file_name, start, end, chunk_bytes):
+  # Batches of lines, a compressed segment is always read as a whole
+  if file_name.endswith('.gz'):
+    with gzip.open(file_name, 'rb') as f:
+      while True:
+        lines = f.readlines(chunk_bytes)
+        if not lines:
+          return
+        yield [line for line in lines if line.strip()]
+  else:
+    for s, e in line_ranges(file_name, chunk_bytes, start, end):
+      yield read_line_range(file_name, s, e)
+
+def merge_log_segments(select_persons, segments, chunk_bytes=MERGE_CHUNK_BYTES):
+  # Time ordered rows of many segments holding only one batch of each segment in memory
+  def segment_rows(file_name, start, end):
+    for lines in log_segment_lines(file_name, start, end, chunk_bytes):
+      yield from zip(*parse_log_lines(select_persons, lines))
+  return heapq.merge(*(segment_rows(*s) for s in segments), key=lambda r: r[0])
+
+def decode_log(log):
+  # A log is a JSON array of event objects, other logs are skipped
+  try:
+    events = loads_json(log)
+  except ValueError:
+    return None
+  if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+    return None
+  return events
+
+def decode_logs(logs):
+  try:
+    decoded = loads_json('[' + ','.join(logs) + ']') if logs else []
+  except ValueError:
+    return [decode_log(log) for log in logs]
+  return [
+    events if isinstance(events, list) and all(isinstance(e, dict) for e in events) else None
+    for events in decoded
+  ]
+
+def event_int(value):
+  if isinstance(value, bool):
+    return None
+  if isinstance(value, float) and value.is_integer():
+    return int(value)
+  return value if isinstance(value, int) else None
+
+def event_dict(value):
+  return value if isinstance(value, dict) else {}
+
+def event_lines(value):
+  return '\n'.join(str(v) for v in value) if isinstance(value, list) else None
+
+def qlc_type(qlcs, qlc):
+  if isinstance(qlcs, list) and isinstance(qlc, int) and 0 <= qlc < len(qlcs):
+    return event_dict(qlcs[qlc]).get('qlctype')
+  return None
+
+def log_events(rows, previous=None, log_column='log'):
+  # One row per event in the log arrays. The submission is keyed by person, time
+  # and the ordinal of the rows that share them, previous rows precede the rows.
+  keys = rows[[PERSON_KEY, TIME_KEY]]
+  if not previous is None:
+    keys = pandas.concat([previous[[PERSON_KEY, TIME_KEY]], keys], ignore_index=True)
+  ordinals = keys.groupby([PERSON_KEY, TIME_KEY], sort=False, dropna=False).cumcount().to_numpy()
+  ordinals = ordinals[keys.shape[0] - rows.shape[0]:]
+  has_log = rows[log_column].map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+  decoded = decode_logs(list(rows.loc[has_log, log_column]))
+  valid = numpy.array([not events is None for events in decoded], dtype=bool)
+  submissions = rows.loc[has_log].loc[valid]
+  ordinals = ordinals[has_log][valid]
+  decoded = [events for events in decoded if not events is None]
+  counts = [len(events) for events in decoded]
+  flat = [event for events in decoded for event in events]
+  starts = [event_dict(e.get('start')) for e in flat]
+  ends = [event_dict(e.get('end')) for e in flat]
+  options = [event_dict(e.get('option')) for e in flat]
+  types = [e.get('type') for e in flat]
+
+  # Questions are answered against the latest qlc-init of the submission
+  qlc_types = [None] * len(flat)
+  corrects = [None] * len(flat)
+  i = 0
+  for n in counts:
+    qlcs = None
+    for j in range(i, i + n):
+      if types[j] == 'qlc-init':
+        qlcs = flat[j].get('qlcs')
+      elif types[j] == 'qlc-select':
+        qlc_types[j] = qlc_type(qlcs, flat[j].get('qlc'))
+        corrects[j] = options[j].get('correct') is True
+    i += n
+
+  events = pandas.DataFrame({
+    PERSON_KEY: submissions[PERSON_KEY].to_numpy().repeat(counts),
+    TIME_KEY: submissions[TIME_KEY].to_numpy().repeat(counts),
+    SUBMISSION_KEY: ordinals.repeat(counts),
+    'type': types,
+    'time': [event_int(e.get('time')) for e in flat],
+    'action': [e.get('action') for e in flat],
+    'start_row': [event_int(p.get('row')) for p in starts],
+    'start_column': [event_int(p.get('column')) for p in starts],
+    'end_row': [event_int(p.get('row')) for p in ends],
+    'end_column': [event_int(p.get('column')) for p in ends],
+    'lines': [event_lines(e.get('lines')) for e in flat],
+    'qlc_type': qlc_types,
+    'answer_type': [o.get('qlctype') for o in options],
+    'answer_text': [o.get('answer') for o in options],
+    'correct': corrects,
+  })
+  return events.astype(EVENT_COLUMNS)
+
+def prefix_checksum(file_name, length):
+  with open(file_name, 'rb') as f:
+    return hashlib.sha256(f.read(length)).hexdigest()
 
 class AcosJsonApi(AbstractApi):
 
+  FETCH_POOL = 'process'
+  TABLE_TAIL_JSON = '{source_id}-{table_id}-tail.json'
+  TABLE_EVENTS_CSV = '{source_id}-{table_id}-events.csv'
+  PREFIX_BYTES = 65536
+
   @classmethod
   def create(cls, source_id, directory):
     return AcosJsonApi(source_id, directory)
@@ -15,56 +184,67 @@ class AcosJsonApi(AbstractApi):
   def __init__(self, source_id, directory):
     super().__init__(source_id)
     self.dir = directory
-    self.log_name_re = re.compile('^(\w+)_\d{6}-\d{6}.log$')
+    self.log_name_re = re.compile(r'^(\w+)_(\d{6}-\d{6})\.log(?:\.(\d+))?(?:\.gz)?$')
 
   def fetch_tables_json(self):
-    tables = []
+    # Rotated and compressed segments of a log form one table
+    segments = {}
     with os.scandir(self.dir) as d:
       for f in [e.name for e in d if e.is_file()]:
         m = self.log_name_re.search(f)
         if not m is None:
-          tables.append({
-            'module_id': None,
-            'module_name': None,
-            'id': m.group(1),
-            'name': m.group(1),
-            'log_file': os.path.join(self.dir, f),
-            'max_points': None,
-            'max_submissions': None,
-            'columns': [{ 'key': 'log' }],
-          })
+          segments.setdefault(m.group(1), []).append(
+            ((m.group(2), -int(m.group(3) or 0), f), os.path.join(self.dir, f))
+          )
+    tables = []
+    for name in sorted(segments):
+      tables.append({
+        'module_id': None,
+        'module_name': None,
+        'id': name,
+        'name': name,
+        'log_files': [f for _, f in sorted(segments[name])],
+        'max_points': None,
+        'max_submissions': None,
+        'columns': [{ 'key': 'log' }],
+      })
     return tables
 
   def fetch_rows_csv(self, table, old_rows, include_personal, select_persons, exclude_columns):
 
-    # NOTE: no use to extend previously fetched rows from complete log dump
-    if not old_rows is None:
-      print(f'* Cached {table["name"]}: to update, remove {os.path.join(*self.table_csv_name(table["id"]))}')
-      return None
+    # Logs are append-only, continue from the offsets of the previous fetch
+    segments = self.log_segments(table, old_rows)
+    if segments is None:
+      print(f'* Log for {table["name"]} was rotated, truncated or interrupted, parsing it again')
+      return self.REFETCH_ROWS
+    select = None if select_persons is None else frozenset(select_persons)
+    new_segments = [s for s in segments if s[2] > s[1]]
+    times, persons, payloads = [], [], []
+    if len(new_segments) == 1 and not new_segments[0][0].endswith('.gz'):
+      log_file, start, end = new_segments[0]
+      parse_range = functools.partial(parse_log_range, select)
+      for t, p, d in parse_ranges(log_file, parse_range, start=start, end=end):
+        times.extend(t)
+        persons.extend(p)
+        payloads.extend(d)
+    else:
+      for t, p, d in merge_log_segments(select, new_segments):
+        times.append(t)
+        persons.append(p)
+        payloads.append(d)
 
-    rows = []
-    with open(table['log_file'], 'r') as f:
-      for line in f:
-        time_s, payload_s, protocol_s = line.split('\t')
-        payload = json.loads(payload_s)
-        protocol = json.loads(protocol_s)
-
-        # Filter rows by persons
-        person = str(protocol.get('uid'))
-        if select_persons is None or person in select_persons:
-
-          # Use default column keys
-          rows.append({
-            **payload,
-            TIME_KEY: datetime.datetime.strptime(time_s, '%Y-%m-%dT%H:%M:%S.%fZ'),
-            GRADE_KEY: payload.get('points'),
-            PERSON_KEY: person,
-          })
-
-    if len(rows) == 0:
+    # Offsets and events are written only after the rows are stored
+    n_old = 0 if old_rows is None else old_rows.shape[0]
+    if len(payloads) == 0:
+      self.after_rows_stored(table, lambda: self.write_log_offsets(table, segments, n_old))
       return None
-    
-    data = pandas.DataFrame(rows)
+
+    # Use default column keys
+    data = pandas.DataFrame.from_records(payloads)
+    data = data.drop(columns=[c for c in (TIME_KEY, GRADE_KEY, PERSON_KEY) if c in data.columns])
+    data[TIME_KEY] = pandas.to_datetime(pandas.Series(times).str.decode('utf-8'), format=LOG_TIME_FORMAT)
+    data[GRADE_KEY] = data['points'] if 'points' in data.columns else None
+    data[PERSON_KEY] = persons
 
     # Filter extra columns
     rm_cols = []
@@ -72,7 +252,77 @@ class AcosJsonApi(AbstractApi):
       rm_cols.extend([])
     if exclude_columns:
       rm_cols.extend(exclude_columns)
-    return data.drop(columns=[c for c in data.columns if c in rm_cols]).reset_index(drop=True)
+    data = data.drop(columns=[c for c in data.columns if c in rm_cols]).reset_index(drop=True)
+    if 'log' in data.columns:
+      self.after_rows_stored(table, lambda: self.store_events(table, old_rows, data))
+    self.after_rows_stored(table, lambda: self.write_log_offsets(table, segments, n_old + data.shape[0]))
+    return data
+
+  def store_events(self, table, old_rows, new_rows):
+    # The log event arrays are normalized once to a sidecar table
+    path = self.table_events_name(table['id'])
+    if old_rows is None:
+      write_table(path, log_events(new_rows))
+    elif find_table_file(path)[0] is None:
+      write_table(path, log_events(pandas.concat([old_rows, new_rows], ignore_index=True)))
+    else:
+      append_table(path, log_events(new_rows, old_rows))
+
+  def sidecar_tables(self, table):
+    return [('events_file', self.table_events_name(table['id']))]
+
+  def log_segments(self, table, old_rows):
+    # Segments as (file, start, end), None if a previously parsed segment has changed
+    # or the stored rows differ from the offsets after an interrupted fetch
+    log_files = table.get('log_files') or [table['log_file']]
+    offsets = {}
+    if not old_rows is None:
+      tail = read_json(self.table_tail_json_name(table['id']))
+      offsets = (tail or {}).get('files')
+      if (
+        offsets is None or tail.get('rows', old_rows.shape[0]) != old_rows.shape[0]
+        or not set(offsets) <= set(log_files)
+        or not all(self.segment_unchanged(f, o) for f, o in offsets.items())
+      ):
+        return None
+    segments = []
+    for f in log_files:
+      start = offsets[f]['offset'] if f in offsets else 0
+      end = os.path.getsize(f) if f.endswith('.gz') else complete_lines_end(f, start)
+      segments.append((f, start, end))
+    return segments
+
+  def segment_unchanged(self, log_file, offset):
+    if not os.path.isfile(log_file):
+      return False
+    size = os.path.getsize(log_file)
+    if size < offset['offset'] or (log_file.endswith('.gz') and size != offset['offset']):
+      return False
+    return prefix_checksum(log_file, min(offset['offset'], self.PREFIX_BYTES)) == offset['prefix']
+
+  def write_log_offsets(self, table, segments, n_rows):
+    write_json(self.table_tail_json_name(table['id']), {
+      'rows': n_rows,
+      'files': {
+        f: {
+          'offset': end,
+          'prefix': prefix_checksum(f, min(end, self.PREFIX_BYTES)),
+        }
+        for f, _, end in segments
+      },
+    })
+
+  def table_tail_json_name(self, table_id):
+    return (
+      STORAGE_DIR,
+      self.TABLE_TAIL_JSON.format(source_id=self.source_id, table_id=table_id),
+    )
+
+  def table_events_name(self, table_id):
+    return (
+      STORAGE_DIR,
+      self.TABLE_EVENTS_CSV.format(source_id=self.source_id, table_id=table_id),
+    )
 
   def file_columns(self, table, rows):
     return []
@@ -85,6 +335,3 @@ class AcosJsonApi(AbstractApi):
 
   def drop_for_export(self, table, rows, volatile_columns):
     return rows
-
-  def fetch_delay(self):
-    pass
@@ -0,0 +1,91 @@
+import threading
+import time
+import email.utils
+from .RateLimiter import RateLimiter, TokenBucket
+
+class HostThrottle:
+
+  def __init__(self, rate, burst, limit):
+    self.bucket = TokenBucket(rate, burst)
+    self.limit = limit
+    self.inflight = 0
+    self.successes = 0
+    self.blocked_until = 0
+    self.cond = threading.Condition()
+
+class AdaptiveThrottle(RateLimiter):
+
+  # Additive increase of rate and concurrency after a window of fast responses,
+  # multiplicative decrease on 429/503 or slow responses, Retry-After blocks the host.
+
+  THROTTLE_STATUS = (429, 503)
+
+  def __init__(self, options):
+    super().__init__(options['start_rate'], options['burst'])
+    self.min_rate = options['min_rate']
+    self.max_rate = options['rate']
+    self.rate_step = max(self.min_rate, self.max_rate / 10)
+    self.max_workers = max(1, options['workers'])
+    self.latency = options['latency']
+    self.hosts = {}
+
+  def bucket(self, url):
+    return self.host_throttle(url).bucket
+
+  def host_throttle(self, url):
+    host = self.host(url)
+    with self.lock:
+      if not host in self.hosts:
+        rate = min(self.max_rate, max(self.min_rate, self.rate))
+        self.hosts[host] = HostThrottle(rate, self.burst, 1)
+      return self.hosts[host]
+
+  def acquire(self, url):
+    h = self.host_throttle(url)
+    with h.cond:
+      while h.inflight >= h.limit:
+        h.cond.wait()
+      h.inflight += 1
+      wait = h.blocked_until - time.monotonic()
+    if wait > 0:
+      time.sleep(wait)
+    h.bucket.take()
+
+  def release(self, url, status, latency, retry_after=None):
+    h = self.host_throttle(url)
+    with h.cond:
+      h.inflight -= 1
+      if status in self.THROTTLE_STATUS or latency > self.latency:
+        h.bucket.set_rate(max(self.min_rate, h.bucket.rate / 2))
+        h.limit = max(1, h.limit // 2)
+        h.successes = 0
+        wait = self.parse_retry_after(retry_after)
+        if wait:
+          h.blocked_until = max(h.blocked_until, time.monotonic() + wait)
+      elif not status is None and status < 500:
+        h.successes += 1
+        if h.successes >= h.limit:
+          h.bucket.set_rate(min(self.max_rate, h.bucket.rate + self.rate_step))
+          h.limit = min(self.max_workers, h.limit + 1)
+          h.successes = 0
+      h.cond.notify_all()
+
+  def state(self):
+    with self.lock:
+      return {
+        host: { 'rate': h.bucket.rate, 'workers': h.limit }
+        for host, h in self.hosts.items()
+      }
+
+  @staticmethod
+  def parse_retry_after(value):
+    if not value:
+      return None
+    try:
+      return max(0, float(value))
+    except ValueError:
+      pass
+    try:
+      return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+      return None
@@ -1,6 +1,6 @@
-import os
 import re
-from ..Config import PERSON_KEY, GRADE_KEY
+from ..Config import STORAGE_DIR, PERSON_KEY, GRADE_KEY
+from ..common import ordered_map
 from .AbstractDjangoApi import AbstractDjangoApi
 
 class AplusApi(AbstractDjangoApi):
@@ -10,6 +10,8 @@ class AplusApi(AbstractDjangoApi):
   EXERCISE_LIST = '{url}courses/{course_id:d}/exercises/'
   SUBMISSION_ROWS = '{url}courses/{course_id:d}/submissiondata/?exercise_id={exercise_id:d}&best=no&format=csv'
   SUBMISSION_DETAILS = '{url}submissions/{submission_id:d}'
+  EXERCISE_DETAILS_DIR = '{source_id}-exercises'
+  EXERCISE_DETAILS_JSON = '{exercise_id}.json'
 
   STATUS_KEY = 'Status'
   PENALTY_KEY = 'Penalty'
@@ -20,7 +22,7 @@ class AplusApi(AbstractDjangoApi):
   REMOVE_AT_EXPORT = [PSEUDO_ITEM_KEY] + REMOVE_PERSONAL_KEYS
   META_KEYS = ['exercise', 'submission_time', 'grading_time', 'grade', 'late_penalty_applied', 'feedback', 'grading_data']
   FILE_KEY_REGEXP = r'^file\d+$'
-  FILE_VAL_REGEXP = r'^https:\/\/[^?]+'
+  FILE_VAL_REGEXP = r'^https?:\/\/[^?]+'
   PERSONAL_FILE_REGEXP = r'^.*filename=\"[^\"]+\.(txt|py|java|scala|c|cpp|js|mat)\".*$'
   PERSONAL_REGEXP = r'# (Nimi|Opiskelijanumero): [\w -]*'
 
@@ -44,43 +46,61 @@ class AplusApi(AbstractDjangoApi):
     return courses  
 
   def fetch_tables_json(self):
-    tables = []
     modules = self.get_paged_json(self.EXERCISE_LIST.format(url=self.url, course_id=self.course_id))
-    for m in modules:
-      for e in m['exercises']:
-        entry = {
-          'module_id': m['id'],
-          'module_name': self.en_name(m['display_name']),
-          'id': e['id'],
-          'name': self.en_name(e['display_name']),
-          'max_points': e['max_points'],
-          'max_submissions': e['max_submissions'],
-          'difficulty': e.get('difficulty'),
-        }
-        self.fetch_delay()
-        details = self.fetch_json(e['url'])
-        form = (details.get('exercise_info') or {}).get('form_spec', [])
-        entry['columns'] = [{ 'key': f['key'] } for f in form if f['type'] != 'static']
-        tables.append(entry)
-    return tables
+
+    def table_entry(item):
+      m, e = item
+      details = self.fetch_json_revalidated(e['url'], self.exercise_details_json_name(e['id']))
+      form = (details.get('exercise_info') or {}).get('form_spec', [])
+      return {
+        'module_id': m['id'],
+        'module_name': self.en_name(m['display_name']),
+        'id': e['id'],
+        'name': self.en_name(e['display_name']),
+        'max_points': e['max_points'],
+        'max_submissions': e['max_submissions'],
+        'difficulty': e.get('difficulty'),
+        'columns': [{ 'key': f['key'] } for f in form if f['type'] != 'static'],
+      }
+
+    # Detail requests are throttled in fetch by the per host limiter
+    return list(ordered_map(
+      table_entry,
+      ((m, e) for m in modules for e in m['exercises']),
+      self.fetch_options['workers']
+    ))
 
   def fetch_rows_csv(self, table, old_rows, include_personal, select_persons, exclude_columns):
 
-    # NOTE: A-plus does not offer filtering by time or id to extend previously fetched rows
+    # NOTE: A-plus does not offer filtering by time or id, new rows are selected by diffing ids
+    known_items = None
     if not old_rows is None:
-      print(f'* Cached {table["name"]}: to update, remove {os.path.join(*self.table_csv_name(table["id"]))}')
-      return None
+      if not self.PSEUDO_ITEM_KEY in old_rows:
+        print(f'* Cached {table["name"]}: to update, remove {self.table_file_name(table["id"])}')
+        return None
+      known_items = set(old_rows[self.PSEUDO_ITEM_KEY])
 
-    url = self.SUBMISSION_ROWS.format(url=self.url, course_id=self.course_id, exercise_id=table['id'])
-    data = self.fetch_csv(url)
-    
-    # Reject rows where status NOT 'ready'
-    if self.STATUS_KEY in data:
-      data = data[data[self.STATUS_KEY] == 'ready']
+    def select_chunk(data):
+
+      # Reject rows that are previously fetched
+      if not known_items is None:
+        data = data[~data[self.PSEUDO_ITEM_KEY].isin(known_items)]
+
+      # Reject rows where status NOT 'ready'
+      if self.STATUS_KEY in data:
+        data = data[data[self.STATUS_KEY] == 'ready']
 
-    # Filter rows by persons
-    if not select_persons is None:
-      data = data[data[self.PSEUDO_USER_KEY].astype(str).isin(select_persons)]
+      # Filter rows by persons
+      if not select_persons is None:
+        data = data[data[self.PSEUDO_USER_KEY].astype(str).isin(select_persons)]
+      return data
+
+    url = self.SUBMISSION_ROWS.format(url=self.url, course_id=self.course_id, exercise_id=table['id'])
+    data = self.fetch_csv(url, select_chunk)
+    if not known_items is None:
+      print(f'* Updating {table["name"]}: {data.shape[0]} new rows')
+      if data.empty:
+        return None
 
     # Cancel late penalties to keep all grades comparable
     def cancel_apply(row):
@@ -96,13 +116,20 @@ class AplusApi(AbstractDjangoApi):
     data[PERSON_KEY] = data[self.PSEUDO_USER_KEY]
 
     # Filter extra columns
-    rm_cols = self.REMOVE_KEYS
+    rm_cols = list(self.REMOVE_KEYS)
     if not include_personal:
       rm_cols.extend(self.REMOVE_PERSONAL_KEYS)
     if exclude_columns:
       rm_cols.extend(exclude_columns)
     return data.drop(columns=[c for c in data.columns if c in rm_cols]).reset_index(drop=True)
 
+  def exercise_details_json_name(self, exercise_id):
+    return (
+      STORAGE_DIR,
+      self.EXERCISE_DETAILS_DIR.format(source_id=self.source_id),
+      self.EXERCISE_DETAILS_JSON.format(exercise_id=exercise_id),
+    )
+
   def file_columns(self, table, rows):
     return [c for c in rows.columns if self.file_key_re.match(c)]
   
@@ -110,6 +137,7 @@ class AplusApi(AbstractDjangoApi):
     url_match = self.file_val_re.match(row[col_name])
     if url_match:
       r = self.fetch(url_match.group(0))
+      r.raise_for_status()
       cd = r.headers.get('content-disposition')
       if not include_personal and self.personal_file_re.match(cd):
         return self.personal_re.sub('', r.text).encode()
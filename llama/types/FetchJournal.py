@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+from ..common import path_to_file_name, ensure_dir
+
+class FetchJournal:
+
+  # Append-only log of completed and failed (item, column) fetches,
+  # the last entry of an item wins when the log is read back.
+
+  def __init__(self, path):
+    self.path = path
+    self.done = set()
+    self.failed = set()
+    self.file = None
+    self.lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    file_name = path_to_file_name(self.path)
+    if os.path.isfile(file_name):
+      with open(file_name, 'r') as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            # Interrupted while writing the last line
+            continue
+          key = (entry['item'], entry['col'])
+          if entry['ok']:
+            self.done.add(key)
+            self.failed.discard(key)
+          else:
+            self.done.discard(key)
+            self.failed.add(key)
+
+  def pending(self, key, retry_failed=False):
+    return key in self.failed if retry_failed else not key in self.done
+
+  def record(self, key, ok):
+    with self.lock:
+      if self.file is None:
+        ensure_dir(self.path)
+        self.file = open(path_to_file_name(self.path), 'a')
+        if self.file.tell() > 0 and not self.ends_with_newline():
+          # Ends the line that was interrupted while writing
+          self.file.write('\n')
+      self.file.write(json.dumps({ 'item': key[0], 'col': key[1], 'ok': ok }) + '\n')
+      self.file.flush()
+      if ok:
+        self.done.add(key)
+        self.failed.discard(key)
+      else:
+        self.failed.add(key)
+
+  def ends_with_newline(self):
+    with open(path_to_file_name(self.path), 'rb') as f:
+      f.seek(-1, os.SEEK_END)
+      return f.read(1) == b'\n'
+
+  def close(self):
+    with self.lock:
+      if not self.file is None:
+        self.file.close()
+        self.file = None
@@ -0,0 +1,17 @@
+class FetchedItem(dict):
+
+  # Result of fetch_items, the content of a cached item is read on first access.
+
+  def __init__(self, read, **values):
+    super().__init__(**values)
+    self.read = read
+
+  def __missing__(self, key):
+    if key != 'content':
+      raise KeyError(key)
+    content = self.read()
+    self['content'] = content
+    return content
+
+  def get(self, key, default=None):
+    return self[key] if key in self or key == 'content' else default
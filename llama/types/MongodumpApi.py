@@ -1,12 +1,57 @@
 import os
 import re
 import json
+import time
+import shutil
+import sqlite3
 import pandas
 from .AbstractApi import AbstractApi
-from ..Config import TIME_KEY, GRADE_KEY, PERSON_KEY
+from ..Config import STORAGE_DIR, TIME_KEY, GRADE_KEY, PERSON_KEY
+from ..common import read_json, write_json, parse_lines
+
+class LinkedRowIndex:
+
+  # Disk-backed _id -> row index for a linked collection too large for memory
+
+  def __init__(self, file_name, rows):
+    self.file_name = file_name
+    self.db = sqlite3.connect(file_name)
+    self.db.execute('CREATE TABLE IF NOT EXISTS rows (id TEXT PRIMARY KEY, row TEXT)')
+    self.db.executemany('INSERT OR IGNORE INTO rows VALUES (?, ?)', ((r['_id'], json.dumps(r)) for r in rows))
+    self.db.commit()
+
+  def get(self, id):
+    row = self.db.execute('SELECT row FROM rows WHERE id = ?', (id,)).fetchone()
+    return None if row is None else json.loads(row[0])
+
+  def close(self):
+    self.db.close()
+    os.remove(self.file_name)
+
+# Flattening plans check each value with the guard of the kind that the first document
+# of the same shape had, the equivalents of value_kind in parse_dump_file
+PLAN_GUARDS = {
+  'map': lambda v: (
+    isinstance(v, list) and len(v) > 0 and isinstance(v[0], dict) and len(v[0]) == 3
+    and '_id' in v[0] and 'key' in v[0] and 'value' in v[0]
+  ),
+  'refs': lambda v: isinstance(v, list) and len(v) > 0 and isinstance(v[0], dict) and len(v[0]) == 1 and '$oid' in v[0],
+  'id': lambda v: isinstance(v, dict),
+  'date': lambda v: isinstance(v, dict) and len(v) == 1 and '$date' in v,
+  'binary': lambda v: isinstance(v, dict) and len(v) == 2 and '$binary' in v and '$type' in v,
+  'ref': lambda v: isinstance(v, dict) and len(v) == 1 and '$oid' in v,
+  'value': lambda v: not isinstance(v, (list, dict)),
+}
 
 class MongodumpApi(AbstractApi):
 
+  FETCH_POOL = 'process'
+  DUMP_DIR = '{source_id}-dump'
+  DUMP_INDEX_JSON = 'index.json'
+  SPOOL_ROWS = 10000
+  LINK_MEMORY_BYTES = 256 * 1024 * 1024
+  MAX_PLANS = 64
+
   @classmethod
   def create(cls, source_id, main_file, database_config):
     return MongodumpApi(source_id, main_file, database_config)
@@ -15,28 +60,25 @@ class MongodumpApi(AbstractApi):
     super().__init__(source_id)
     self.config = database_config
     self.main_files = main_file.split(',')
-    self.loaded_dump = None
+    self.spool = None
+    self.partitions = None
+    self.dump_tables = None
     self.drop_columns_re = re.compile(self.config['drop_keys_re'])
     self.show_columns_re = re.compile(self.config['show_keys_re'])
 
+  def __getstate__(self):
+    # The loaded partitions are local to the parsing process
+    state = super().__getstate__()
+    for key in ('spool', 'partitions', 'dump_tables'):
+      state[key] = None
+    return state
+
   def fetch_tables_json(self):
-    dump = self.parse_dump()
+    self.partition_dump()
     modules = []
-    
-    def row_filter(row):
-      for type, key, value in self.config['table_filters']:
-        if (
-          (type == '==' and row.get(key) == value)
-          or (type == '!=' and row.get(key) != value)
-        ):
-          return True
-      return False
-    
-    for row in dump:
+    for row in self.dump_tables:
       module_id = row.get(self.config['module_key'])
       table_id = row.get(self.config['table_key'])
-      if module_id is None or table_id is None or row_filter(row):
-        continue
       module = next((m for m in modules if m['id'] == module_id), None)
       if module is None:
         module = { 'id': module_id, 'tables': [] }
@@ -62,14 +104,16 @@ class MongodumpApi(AbstractApi):
 
     # NOTE: no use to extend previously fetched rows from complete database dump
     if not old_rows is None:
-      print(f'* Cached {table["name"]}: to update, remove {os.path.join(*self.table_csv_name(table["id"]))}')
+      print(f'* Cached {table["name"]}: to update, remove {self.table_file_name(table["id"])}')
       return None
 
-    data = pandas.DataFrame(self.parse_dump())
+    if not table['full_id'] in self.partition_dump():
+      print(f'* No rows for #{table["id"]} in the database dump')
+      return None
+    data = pandas.DataFrame(self.read_partition(table['full_id']))
 
     # Filter rows to the target
     print('> Selecting for #{}'.format(table['id']))
-    data = data[data[self.config['table_key']] == table['full_id']]
     for type, key, value in self.config['table_filters']:
       if key in data:
         if type == '==':
@@ -105,7 +149,8 @@ class MongodumpApi(AbstractApi):
     return [c for c in rows.columns if c.startswith('files_') and c.endswith('_key')]
 
   def fetch_file(self, table, row, col_name, include_personal):
-    return row.get(col_name.replace('_key', '_content'))
+    content = row.get(col_name.replace('_key', '_content'))
+    return content.encode() if type(content) == str else content
 
   def fetch_meta_json(self, table, row, include_personal):
     return None
@@ -114,75 +159,258 @@ class MongodumpApi(AbstractApi):
     rm_cols = [self.config['pseudo_item_key']] + self.config['personal_keys']
     return rows.drop(columns=[c for c in rows.columns if c in rm_cols])
 
-  def fetch_delay(self):
-    pass
+  def row_filter(self, row):
+    for type, key, value in self.config['table_filters']:
+      if (
+        (type == '==' and row.get(key) == value)
+        or (type == '!=' and row.get(key) != value)
+      ):
+        return True
+    return False
+
+  def partition_dump(self):
+    if self.partitions is None:
+      dump_dir = os.path.join(STORAGE_DIR, self.DUMP_DIR.format(source_id=self.source_id))
+      fingerprint = self.dump_fingerprint()
+      index = read_json((dump_dir, self.DUMP_INDEX_JSON))
+      if index is None or index['fingerprint'] != fingerprint:
+        index = self.write_dump_cache(dump_dir, fingerprint)
+      else:
+        print(f'> Using parsed database dump {dump_dir}')
+      self.partitions = { t: os.path.join(dump_dir, f) for t, f in index['partitions'].items() }
+      self.dump_tables = index['tables']
+    return self.partitions
+
+  def dump_fingerprint(self):
+    # Linked collections may be any file next to the main files
+    files = set()
+    for main_file in self.main_files:
+      dir = os.path.dirname(main_file) or '.'
+      _, ext = os.path.splitext(main_file)
+      files.update(os.path.join(dir, f) for f in os.listdir(dir) if f.endswith(ext))
+    return json.loads(json.dumps({
+      'main_files': self.main_files,
+      'files': [[os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)] for f in sorted(files)],
+      'config': self.config,
+    }))
+
+  def write_dump_cache(self, dump_dir, fingerprint):
+    # One pass over the dump spools the rows to a file per table
+    tmp_dir = f'{dump_dir}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    self.spool = tmp_dir
+    partitions = {}
+    tables = {}
+    buffered = {}
+    n = 0
+
+    def flush():
+      for table_id, lines in buffered.items():
+        with open(os.path.join(tmp_dir, partitions[table_id]), 'a') as f:
+          f.writelines(lines)
+      buffered.clear()
+
+    cached_links = {}
+    for file_path in self.main_files:
+      for row in self.parse_dump_file(file_path, cached_links):
+        table_id = row.get(self.config['table_key'])
+        if table_id is None:
+          continue
+        if not table_id in partitions:
+          partitions[table_id] = f'{len(partitions)}.jsonl'
+        if not table_id in tables and not row.get(self.config['module_key']) is None and not self.row_filter(row):
+          tables[table_id] = row
+        buffered.setdefault(table_id, []).append(json.dumps(row) + '\n')
+        n += 1
+        if n % self.SPOOL_ROWS == 0:
+          flush()
+    flush()
+    for index, _ in cached_links.values():
+      if isinstance(index, LinkedRowIndex):
+        index.close()
+    self.spool = None
+
+    # The index is written last and the complete cache replaces the old one
+    index = { 'fingerprint': fingerprint, 'partitions': partitions, 'tables': list(tables.values()) }
+    write_json((tmp_dir, self.DUMP_INDEX_JSON), index)
+    shutil.rmtree(dump_dir, ignore_errors=True)
+    os.replace(tmp_dir, dump_dir)
+    return read_json((dump_dir, self.DUMP_INDEX_JSON))
 
-  def parse_dump(self):
-    if self.loaded_dump is None:
-      cached_links = {}
-      self.loaded_dump = []
-      for f in self.main_files:
-        self.loaded_dump.extend(self.parse_dump_file(f, cached_links))
-    return self.loaded_dump
+  def read_partition(self, table_id):
+    with open(self.partitions[table_id], 'r') as f:
+      return [json.loads(line) for line in f]
+
+  def index_linked_file(self, file_path, cached_links):
+    # Also collects the ids of items that have values to unpack again
+    nested = set()
+
+    def rows():
+      for item in self.parse_dump_file(file_path, cached_links):
+        if any(isinstance(v, (list, dict)) for v in item.values()):
+          nested.add(item['_id'])
+        yield item
+
+    if os.path.getsize(file_path) > self.LINK_MEMORY_BYTES:
+      return LinkedRowIndex(os.path.join(self.spool, f'link-{len(cached_links)}.sqlite'), rows()), nested
+    index = {}
+    for item in rows():
+      index.setdefault(item['_id'], item)
+    return index, nested
 
   def parse_dump_file(self, file_path, cached_links):
     dir = os.path.dirname(file_path)
     _, ext = os.path.splitext(file_path)
 
-    def load_linked_file(key):
-      for name in [p.format(key) for p in self.config['references_to_collections']]:
-        path = os.path.join(dir, name + ext)
-        if os.path.exists(path):
-          return self.parse_dump_file(path, cached_links)
-      return None
-
     def find_linked_file(key):
-      if not key in cached_links:
-        cached_links[key] = load_linked_file(key)
-      return cached_links[key]
+      # Linked collections are indexed once per directory and shared by all main files
+      link = (dir, ext, key)
+      if not link in cached_links:
+        cached_links[link] = (None, set())
+        for name in [p.format(key) for p in self.config['references_to_collections']]:
+          path = os.path.join(dir, name + ext)
+          if os.path.exists(path):
+            cached_links[link] = self.index_linked_file(path, cached_links)
+            break
+      return cached_links[link]
 
-    def find_linked_item(key, id):
-      for item in find_linked_file(key) or []:
-        if item['_id'] == id:
-          return item
-      return { '_id': id }
+    def unpack_map(out, key, val):
+      for e in val:
+        out['_'.join([key, e.get('key')])] = e.get('value')
 
-    def unpack_val(out, key, val):
+    linked_names = {}
+
+    def linked_values(prefix, link, id):
+      # Linked items are already unpacked, except values of key-value maps
+      index, nested = link
+      item = None if index is None else index.get(id)
+      if item is None:
+        return ((f'{prefix}__id', id),)
+      if id in nested:
+        out = {}
+        for k, v in item.items():
+          unpack_val(out, f'{prefix}_{k}', v)
+        return out.items()
+      shape = (prefix, tuple(item))
+      names = linked_names.get(shape)
+      if names is None:
+        names = linked_names[shape] = [f'{prefix}_{k}' for k in item]
+      return zip(names, item.values())
+
+    def unpack_refs(out, key, val):
+      link = find_linked_file(key)
+      for i, e in enumerate(val):
+        out.update(linked_values(f'{key}_{i}', link, e.get('$oid')))
+
+    def unpack_ref(out, key, val):
+      out.update(linked_values(key, find_linked_file(key), val['$oid']))
+
+    def unpack_field(field):
+      def unpack(out, key, val):
+        out[key] = val.get(field)
+      return unpack
+
+    def unpack_value(out, key, val):
+      out[key] = val
+
+    UNPACK = {
+      'map': unpack_map,
+      'refs': unpack_refs,
+      'id': unpack_field('$oid'),
+      'date': unpack_field('$date'),
+      'binary': unpack_field('$binary'),
+      'ref': unpack_ref,
+      'value': unpack_value,
+    }
+
+    def value_kind(key, val):
       if isinstance(val, list):
         # Support selected list types (custom key-value map, references)
-        if len(val) > 0:
-          if isinstance(val[0], dict):
-            local_keys = set(val[0].keys())
-            if local_keys == {'_id', 'key', 'value'}:
-              for e in val:
-                out['_'.join([key, e.get('key')])] = e.get('value')
-            elif local_keys == {'$oid'}:
-              for i, e in enumerate(val):
-                for k, v in find_linked_item(key, e.get('$oid')).items():
-                  unpack_val(out, '_'.join([key, str(i), k]), v)
-      elif isinstance(val, dict):
+        if len(val) > 0 and isinstance(val[0], dict):
+          local_keys = set(val[0].keys())
+          if local_keys == {'_id', 'key', 'value'}:
+            return 'map'
+          if local_keys == {'$oid'}:
+            return 'refs'
+        return None
+      if isinstance(val, dict):
         # Support selected special types (date, binary, reference)
-        local_keys = set(val.keys())
         if key == '_id':
-          out[key] = val.get('$oid')
-        elif local_keys == {'$date'}:
-          out[key] = val.get('$date')
-        elif local_keys == {'$binary', '$type'}:
-          out[key] = val.get('$binary')
-        elif local_keys == {'$oid'}:
-          for k, v in find_linked_item(key, val['$oid']).items():
-            unpack_val(out, '_'.join([key, k]), v)
-      else:
-        out[key] = val
+          return 'id'
+        local_keys = set(val.keys())
+        if local_keys == {'$date'}:
+          return 'date'
+        if local_keys == {'$binary', '$type'}:
+          return 'binary'
+        if local_keys == {'$oid'}:
+          return 'ref'
+        return None
+      return 'value'
 
-    print('> Parsing database dump {}'.format(file_path))
-    loaded = []
-    with open(file_path, 'r') as file:
-      for line in file:
-        row = json.loads(line)
+    def unpack_val(out, key, val):
+      kind = value_kind(key, val)
+      if not kind is None:
+        UNPACK[kind](out, key, val)
+
+    def unpack_row(row):
+      out = {}
+      for key, val in row.items():
+        if key != '__v':
+          unpack_val(out, key, val)
+      return out
+
+    def unpack_none(out, key, val):
+      pass
+
+    def plan_step(key, kind):
+      # Guard and unpack of one key, links are looked up once per plan
+      if kind is None:
+        return key, lambda v: value_kind(key, v) is None, unpack_none
+      if kind == 'refs':
+        link = find_linked_file(key)
+        def unpack(out, key, val):
+          for i, e in enumerate(val):
+            out.update(linked_values(f'{key}_{i}', link, e.get('$oid')))
+        return key, PLAN_GUARDS[kind], unpack
+      if kind == 'ref':
+        link = find_linked_file(key)
+        def unpack(out, key, val):
+          out.update(linked_values(key, link, val['$oid']))
+        return key, PLAN_GUARDS[kind], unpack
+      return key, PLAN_GUARDS[kind], UNPACK[kind]
+
+    def compile_plan(row):
+      # Documents of a collection mostly share a shape: the kinds of values in the first
+      # document are planned as steps that check and unpack a document of the same keys,
+      # or return None when a value has a different kind
+      steps = [plan_step(key, value_kind(key, val)) for key, val in row.items() if key != '__v']
+      def plan(row):
         out = {}
-        for key, val in row.items():
-          if key != '__v':
-            unpack_val(out, key, val)
-        loaded.append(out)
-    return loaded
+        for key, guard, unpack in steps:
+          v = row[key]
+          if not guard(v):
+            return None
+          unpack(out, key, v)
+        return out
+      return plan
+
+    print('> Parsing database dump {}'.format(file_path))
+    plans = {}
+    n = 0
+    planned = 0
+    start = time.time()
+    for row in parse_lines(file_path):
+      shape = tuple(row.keys())
+      plan = plans.get(shape)
+      if plan is None and len(plans) < self.MAX_PLANS:
+        plan = plans[shape] = compile_plan(row)
+      out = None if plan is None else plan(row)
+      if out is None:
+        out = unpack_row(row)
+      else:
+        planned += 1
+      n += 1
+      yield out
+    seconds = max(time.time() - start, 1e-6)
+    print(f'> Parsed {n} documents in {seconds:.1f}s ({n / seconds:.0f}/s, {planned} by {len(plans)} plans)')
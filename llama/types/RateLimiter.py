@@ -0,0 +1,64 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+class TokenBucket:
+
+  def __init__(self, rate, burst=1):
+    self.rate = rate
+    self.burst = max(1, burst)
+    self.tokens = self.burst
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def reserve(self):
+    # Takes a token, possibly in debt, and returns the seconds to wait for it
+    if not self.rate or self.rate <= 0:
+      return 0
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      self.tokens -= 1
+      return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+  def set_rate(self, rate):
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      self.rate = rate
+
+  def take(self):
+    wait = self.reserve()
+    if wait > 0:
+      time.sleep(wait)
+
+class RateLimiter:
+
+  def __init__(self, rate, burst=1):
+    self.rate = rate
+    self.burst = burst
+    self.buckets = {}
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def host(url):
+    return urlsplit(url).netloc
+
+  def bucket(self, url):
+    host = self.host(url)
+    with self.lock:
+      if not host in self.buckets:
+        self.buckets[host] = TokenBucket(self.rate, self.burst)
+      return self.buckets[host]
+
+  def acquire(self, url):
+    self.bucket(url).take()
+
+  def release(self, url, status, latency, retry_after=None):
+    pass
+
+  def state(self):
+    with self.lock:
+      return { host: { 'rate': b.rate, 'workers': 1 } for host, b in self.buckets.items() }
@@ -1,5 +1,6 @@
 from ..common import require
 from . import aplus, acosjson, mongodump
+from .AdaptiveThrottle import AdaptiveThrottle
 
 TYPES = [
   {
@@ -37,12 +38,19 @@ def create_client(src):
     return t['construct'](src)
   return None
 
-def enumerate_sources(config):
-  return [(i, src, create_client(src)) for i, src in enumerate(config.sources)]
+def enumerate_sources(config, fetch_options=None):
+  options = { **config.fetch, **(fetch_options or {}) }
+  limiter = AdaptiveThrottle(options)
+  sources = []
+  for i, src in enumerate(config.sources):
+    api = create_client(src)
+    api.configure_fetch(options, limiter)
+    sources.append((i, src, api))
+  return sources
 
-def get_sources_with_tables(config):
+def get_sources_with_tables(config, fetch_options=None):
   sources = []
-  for i, src, api in enumerate_sources(config):
+  for i, src, api in enumerate_sources(config, fetch_options):
     tables, cached = api.list_tables(only_cache=True)
     require(cached, 'No table list loaded, use "list" command first')
     sources.append({
@@ -0,0 +1,175 @@
+import os
+import gzip
+import json
+import tempfile
+import unittest
+
+from llama.Config import TIME_KEY, GRADE_KEY, PERSON_KEY
+from llama.common import read_table
+from llama.operations import ensure_column_types
+from llama.types.AcosJsonApi import AcosJsonApi
+
+def log_events(i):
+  return json.dumps([
+    { 'type': 'reset', 'time': 1546344000000 + i },
+    {
+      'type': 'editor-change', 'action': 'insert', 'time': 1546344000100 + i,
+      'start': { 'row': 0, 'column': i }, 'end': { 'row': 1, 'column': 0 }, 'lines': ['a', ''],
+    },
+    { 'type': 'qlc-init', 'time': 1546344000200 + i, 'qlcs': [{ 'qlctype': 'VariableDeclaration' }] },
+    { 'type': 'qlc-select', 'time': 1546344000300 + i, 'qlc': 0, 'option': { 'qlctype': 'correct', 'answer': 'x' } },
+  ])
+
+def log_line(i, uid):
+  return '\t'.join([
+    f'2019-01-01T12:{i // 60:02d}:{i % 60:02d}.000Z',
+    json.dumps({ 'points': i % 10, 'max_points': 10, 'status': 'graded', 'log': log_events(i) }),
+    json.dumps({ 'uid': str(uid), 'ip': '1.2.3.4' }),
+  ]) + '\n'
+
+class TestAcosJsonApi(unittest.TestCase):
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.TemporaryDirectory()
+    os.chdir(self.dir.name)
+    os.makedirs('logs')
+    self.log_file = os.path.join('logs', 'demo_190101-120000.log')
+    self.write_log(range(0, 20))
+    self.api = AcosJsonApi('acos', 'logs')
+    self.table = self.api.fetch_tables_json()[0]
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.dir.cleanup()
+
+  def write_log(self, lines, mode='w', tail=''):
+    with open(self.log_file, mode) as f:
+      f.write(''.join(log_line(i, i % 3) for i in lines) + tail)
+
+  def test_tail(self):
+    rows, cached = self.api.fetch_rows(self.table)
+    self.assertFalse(cached)
+    self.assertEqual(rows.shape[0], 20)
+    self.write_log(range(20, 25), 'a', log_line(25, 0)[:12])
+    rows, cached = self.api.fetch_rows(self.table)
+    self.assertTrue(cached)
+    self.assertEqual(rows.shape[0], 25)
+    self.write_log([], 'a', log_line(25, 0)[12:])
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 26)
+    self.assertEqual(list(rows[GRADE_KEY]), [i % 10 for i in range(26)])
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 26)
+    rows, _ = self.api.fetch_rows(self.table, only_cache=True)
+    self.assertEqual(rows.shape[0], 26)
+
+  def test_interrupted_append(self):
+    self.api.fetch_rows(self.table)
+    self.write_log(range(20, 25), 'a')
+    append_rows = self.api.append_rows
+    def fail(*args):
+      raise OSError('No space left on device')
+    self.api.append_rows = fail
+    with self.assertRaises(OSError):
+      self.api.fetch_rows(self.table)
+    self.api.append_rows = append_rows
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 25)
+    events = read_table(self.api.table_events_name(self.table['id']))
+    self.assertEqual(events.shape[0], 4 * 25)
+
+  def test_interrupted_commit(self):
+    self.api.fetch_rows(self.table)
+    self.write_log(range(20, 25), 'a')
+    write_log_offsets = self.api.write_log_offsets
+    def fail(*args):
+      raise OSError('Killed')
+    self.api.write_log_offsets = fail
+    with self.assertRaises(OSError):
+      self.api.fetch_rows(self.table)
+    self.api.write_log_offsets = write_log_offsets
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 25)
+    self.assertEqual(read_table(self.api.table_csv_name(self.table['id'])).shape[0], 25)
+    events = read_table(self.api.table_events_name(self.table['id']))
+    self.assertEqual(events.shape[0], 4 * 25)
+
+  def test_events(self):
+    rows, _ = self.api.fetch_rows(self.table)
+    events_path = self.api.table_events_name(self.table['id'])
+    events = ensure_column_types(read_table(events_path))
+    self.assertEqual(events.shape[0], 4 * 20)
+    self.assertEqual(list(events['type'][:4]), ['reset', 'editor-change', 'qlc-init', 'qlc-select'])
+    edit = events.iloc[4 + 1]
+    self.assertEqual((edit['start_column'], edit['lines']), (1, 'a\n'))
+    self.assertEqual(events['qlc_type'][3], 'VariableDeclaration')
+    self.assertFalse(events['correct'][3])
+    self.assertEqual(events[PERSON_KEY][4], rows[PERSON_KEY][1])
+    self.write_log(range(20, 22), 'a')
+    self.api.fetch_rows(self.table)
+    self.assertEqual(read_table(events_path).shape[0], 4 * 22)
+
+  def test_malformed_events(self):
+    logs = [
+      [{ 'type': 'qlc-init', 'qlcs': [{ 'qlctype': 'A' }] }, { 'type': 'qlc-select', 'qlc': 3 }, { 'type': 'qlc-select' }],
+      [{ 'type': 'editor-change', 'time': 'later', 'lines': 'ab', 'start': 5 }],
+      '{"type": "reset"',
+      { 'type': 'reset' },
+      [{ 'type': 'reset', 'time': 1 }],
+      [{ 'type': 'reset', 'time': 2 }],
+    ]
+    with open(self.log_file, 'w') as f:
+      for i, log in enumerate(logs):
+        f.write('\t'.join([
+          '2019-01-01T12:00:00.000Z',
+          json.dumps({ 'log': log if isinstance(log, str) else json.dumps(log) }),
+          json.dumps({ 'uid': '1' }),
+        ]) + '\n')
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 6)
+    events = ensure_column_types(read_table(self.api.table_events_name(self.table['id'])))
+    self.assertEqual(list(events['Submission']), [0, 0, 0, 1, 4, 5])
+    self.assertTrue(events['qlc_type'][1:3].isna().all())
+    self.assertTrue(events['time'][3:4].isna().all())
+    self.assertEqual(list(events['time'][4:]), [1, 2])
+
+  def test_select_persons(self):
+    rows = self.api.fetch_rows_csv(self.table, None, False, ['1', '2'], None)
+    self.assertEqual(rows.shape[0], 13)
+    self.assertEqual(set(rows[PERSON_KEY]), { '1', '2' })
+    self.assertEqual(rows[TIME_KEY].dtype.kind, 'M')
+    self.assertEqual(rows[TIME_KEY].iloc[0].second, 1)
+
+  def test_rotated(self):
+    self.api.fetch_rows(self.table)
+    self.write_log(range(100, 130))
+    rows, cached = self.api.fetch_rows(self.table)
+    self.assertTrue(cached)
+    self.assertEqual(rows.shape[0], 30)
+    self.write_log(range(0, 5))
+    rows, _ = self.api.fetch_rows(self.table)
+    self.assertEqual(rows.shape[0], 5)
+    rows, _ = self.api.fetch_rows(self.table, only_cache=True)
+    self.assertEqual(rows.shape[0], 5)
+
+  def test_segments(self):
+    with gzip.open(os.path.join('logs', 'demo_190101-120000.log.1.gz'), 'wt') as f:
+      f.write(''.join(log_line(i, 0) for i in range(5, 45, 2)))
+    with open(os.path.join('logs', 'other_190101-120000.log'), 'w') as f:
+      f.write(log_line(0, 0))
+    tables = self.api.fetch_tables_json()
+    self.assertEqual([t['id'] for t in tables], ['demo', 'other'])
+    self.assertEqual(len(tables[0]['log_files']), 2)
+    rows, _ = self.api.fetch_rows(tables[0])
+    self.assertEqual(rows.shape[0], 40)
+    self.assertTrue(rows[TIME_KEY].is_monotonic_increasing)
+    with open(os.path.join('logs', 'demo_190102-120000.log'), 'w') as f:
+      f.write(''.join(log_line(i, 0) for i in range(100, 110)))
+    self.write_log(range(50, 52), 'a')
+    rows, _ = self.api.fetch_rows(self.api.fetch_tables_json()[0])
+    self.assertEqual(rows.shape[0], 52)
+    self.assertTrue(rows[TIME_KEY].is_monotonic_increasing)
+
+if __name__ == '__main__':
+  unittest.main()
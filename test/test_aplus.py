@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+import requests
+
+from llama.Config import TIME_KEY
+from llama.AplusStandIn import AplusStandIn
+from llama.types.AplusApi import AplusApi
+
+class TestAplusApi(unittest.TestCase):
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.TemporaryDirectory()
+    os.chdir(self.dir.name)
+    self.standin = AplusStandIn(exercises=25, submissions=40)
+    self.standin.PAGE_LIMIT = 2
+    url = self.standin.start()
+    self.api = AplusApi(f'{url}/api/v2/', 'test', AplusStandIn.COURSE_ID)
+    self.api.configure_fetch({ 'workers': 4, 'rate': 1000, 'start_rate': 1000 })
+
+  def tearDown(self):
+    self.standin.stop()
+    os.chdir(self.cwd)
+    self.dir.cleanup()
+
+  def test_tables(self):
+    tables = self.api.fetch_tables_json()
+    self.assertSequenceEqual([t['id'] for t in tables], list(range(1, 26)))
+    self.assertEqual(tables[0]['columns'], [{ 'key': 'file1' }, { 'key': 'field_0' }])
+    before = self.standin.stats()['bytes']
+    self.assertEqual(self.api.fetch_tables_json(), tables)
+    self.assertLess(self.standin.stats()['bytes'] - before, before)
+
+  def test_revalidated_error(self):
+    path = ('fetched', 'missing.json')
+    with self.assertRaises(requests.HTTPError):
+      self.api.fetch_json_revalidated(f'{self.standin.url}/api/v2/missing/', path)
+    self.assertFalse(os.path.exists(os.path.join(*path)))
+
+  def test_rows(self):
+    table = { 'id': 3, 'name': 'Exercise 3' }
+    rows, cached = self.api.fetch_rows(table)
+    self.assertFalse(cached)
+    self.assertEqual(rows.shape[0], 38)
+    self.assertNotIn('Email', rows.columns)
+    files = list(self.api.fetch_files(table, rows))
+    self.assertEqual(len(files), 38)
+    self.assertNotIn(b'# Nimi', files[0]['content'])
+
+  def test_refresh_rows(self):
+    table = { 'id': 3, 'name': 'Exercise 3' }
+    rows, _ = self.api.fetch_rows(table)
+    self.standin.submissions = 60
+    rows, cached = self.api.fetch_rows(table)
+    self.assertTrue(cached)
+    self.assertEqual(rows.shape[0], 57)
+    self.assertEqual(rows[TIME_KEY].dtype.kind, 'M')
+    stored, _ = self.api.fetch_rows(table, only_cache=True)
+    self.assertEqual(list(stored[TIME_KEY]), list(rows[TIME_KEY]))
+
+if __name__ == '__main__':
+  unittest.main()
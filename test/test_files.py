@@ -0,0 +1,161 @@
+import os
+import tempfile
+import threading
+import unittest
+import pandas
+
+from llama.common import (
+  configure_storage, storage_options, read_table, write_table, append_table, table_format_available,
+  read_any, write_any, copy_item, migrate_items, item_exists, item_store
+)
+from llama.types.FetchedItem import FetchedItem
+from llama.operations import ensure_column_types
+
+ROWS = pandas.DataFrame({
+  'Time': ['2021-01-01 10:00:00', '2021-01-02 11:00:00'],
+  'Person': [101, 102],
+  'Grade': [1.0, 0.5],
+})
+
+class TestTableStorage(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = (self.dir.name, 'src-1-rows.csv')
+    self.storage = storage_options()
+
+  def tearDown(self):
+    configure_storage(self.storage)
+    self.dir.cleanup()
+
+  def test_compressed(self):
+    configure_storage({ 'tables': 'csv', 'compression': 'gzip', 'compressed_roots': [self.dir.name] })
+    file_name = write_table(self.path, ROWS)
+    self.assertTrue(file_name.endswith('.csv.gz'))
+    append_table(self.path, ROWS)
+    self.assertEqual(read_table(self.path).shape, (4, 3))
+    configure_storage({ 'compression': None })
+    self.assertTrue(write_table(self.path, ROWS).endswith('.csv'))
+    self.assertEqual(os.listdir(self.dir.name), ['src-1-rows.csv'])
+
+  def test_csv(self):
+    configure_storage({ 'tables': 'csv' })
+    write_table(self.path, ROWS)
+    append_table(self.path, ROWS)
+    rows = read_table(self.path)
+    self.assertEqual(rows.shape, (4, 3))
+
+  def test_object_person(self):
+    rows = ensure_column_types(pandas.DataFrame({ 'Person': pandas.Series([101, 102.5], dtype=object) }))
+    self.assertEqual(list(rows['Person']), ['101', '102.5'])
+
+  @unittest.skipUnless(table_format_available('parquet'), 'requires pyarrow')
+  def test_typed(self):
+    for fmt in ('parquet', 'feather'):
+      configure_storage({ 'tables': fmt })
+      file_name = write_table(self.path, ensure_column_types(ROWS.copy()))
+      self.assertTrue(file_name.endswith(fmt))
+      append_table(self.path, ensure_column_types(ROWS.copy()))
+      rows = read_table(self.path)
+      self.assertEqual(rows.shape, (4, 3))
+      self.assertTrue(pandas.api.types.is_datetime64_any_dtype(rows['Time']))
+      self.assertEqual(os.listdir(self.dir.name), [os.path.basename(file_name)])
+
+  @unittest.skipUnless(table_format_available('parquet'), 'requires pyarrow')
+  def test_mixed_column(self):
+    configure_storage({ 'tables': 'parquet' })
+    write_table(self.path, pandas.DataFrame({ 'a': [1, 'x', None] }))
+    a = read_table(self.path)['a']
+    self.assertSequenceEqual(list(a[:2]), ['1', 'x'])
+    self.assertTrue(pandas.isna(a[2]))
+
+class TestItemStorage(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.storage = storage_options()
+    self.fetched = os.path.join(self.dir.name, 'fetched')
+    self.export = os.path.join(self.dir.name, 'export')
+
+  def tearDown(self):
+    configure_storage(self.storage)
+    self.dir.cleanup()
+
+  def test_blobs(self):
+    configure_storage({ 'files': 'blobs', 'roots': [self.fetched, self.export], 'manifest_roots': [self.fetched] })
+    write_any((self.fetched, 'src-1', 'a', 'file'), b'same')
+    write_any((self.fetched, 'src-1', 'b', 'file'), b'same')
+    copy_item((self.fetched, 'src-1', 'a', 'file'), (self.export, 'src-1', 'x', 'file'))
+    self.assertEqual(read_any((self.export, 'src-1', 'x', 'file')), b'same')
+    self.assertEqual(len(os.listdir(os.path.join(self.fetched, 'blobs'))), 1)
+    self.assertIn('src-1-manifest.jsonl', os.listdir(self.fetched))
+    self.assertNotIn('src-1-manifest.jsonl', os.listdir(self.export))
+
+  def test_parallel_dirs(self):
+    configure_storage({ 'files': 'dirs', 'roots': [self.fetched] })
+    errors = []
+    def write(i):
+      try:
+        write_any((self.fetched, 'src-1', f'u{i}', 'file'), b'content')
+      except OSError as e:
+        errors.append(e)
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(len(os.listdir(os.path.join(self.fetched, 'src-1'))), 8)
+
+  def test_migrate(self):
+    configure_storage({ 'files': 'dirs', 'roots': [self.fetched] })
+    write_any((self.fetched, 'src-1', 'a', 'file'), b'content')
+    self.assertEqual(migrate_items(self.fetched, 'src-1', 'blobs'), 1)
+    self.assertFalse(os.path.isdir(os.path.join(self.fetched, 'src-1', 'a')))
+    self.assertEqual(read_any((self.fetched, 'src-1', 'a', 'file')), b'content')
+    self.assertEqual(migrate_items(self.fetched, 'src-1', 'dirs'), 1)
+    self.assertEqual(read_any((self.fetched, 'src-1', 'a', 'file')), b'content')
+
+  def test_packed(self):
+    configure_storage({ 'files': 'packed', 'roots': [self.fetched] })
+    write_any((self.fetched, 'src-1', 'a', 'file'), b'content')
+    self.assertEqual(read_any((self.fetched, 'src-1', 'a', 'file')), b'content')
+    self.assertFalse(os.path.isdir(os.path.join(self.fetched, 'src-1')))
+    self.assertEqual(migrate_items(self.fetched, 'src-1', 'blobs'), 1)
+    self.assertFalse(os.path.isfile(os.path.join(self.fetched, 'src-1.sqlite')))
+    self.assertEqual(read_any((self.fetched, 'src-1', 'a', 'file')), b'content')
+
+  def test_compressed(self):
+    configure_storage({ 'files': 'dirs', 'roots': [self.fetched], 'compression': 'gzip', 'compressed_roots': [self.fetched] })
+    path = (self.fetched, 'src-1', 'a', 'file')
+    write_any(path, b'content' * 10)
+    self.assertEqual(os.listdir(os.path.join(self.fetched, 'src-1', 'a')), ['file.gz'])
+    self.assertEqual(read_any(path), b'content' * 10)
+    configure_storage({ 'compression': None })
+    self.assertEqual(migrate_items(self.fetched, 'src-1', 'packed', recompress=True), 1)
+    self.assertEqual(read_any(path), b'content' * 10)
+
+  def test_manifest(self):
+    configure_storage({ 'files': 'dirs', 'roots': [self.fetched], 'manifest_roots': [self.fetched] })
+    path = (self.fetched, 'src-1', 'a', 'file')
+    self.assertFalse(item_exists(path))
+    write_any(path, b'content')
+    write_any(path, b'content')
+    store, key = item_store(path)
+    self.assertEqual(store.manifest.get(key)['size'], 7)
+    self.assertEqual(store.manifest.stored_keys(), [key])
+    with open(store.manifest.file_name) as f:
+      self.assertEqual(len(f.readlines()), 1)
+    self.assertTrue(item_exists(path))
+
+  def test_lazy_content(self):
+    reads = []
+    item = FetchedItem(lambda: reads.append(1) or b'content', cached=True)
+    self.assertTrue(item['cached'])
+    self.assertEqual(reads, [])
+    self.assertEqual(item['content'], b'content')
+    self.assertEqual(item.get('content'), b'content')
+    self.assertEqual(reads, [1])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,9 @@
+import os
+import tempfile
 import unittest
+import pandas
 
+from llama.Config import TIME_KEY, PERSON_KEY
 from llama.Filters import Filters
 
 SOURCES = [
@@ -62,5 +66,61 @@ class TestFilters(unittest.TestCase):
     fl = Filters([{ 'source': 0, 'table': '1' }], inclusive=True)
     self.assertSequenceEqual(table_ids(fl.filter(SOURCES)), ['T1'])
 
+class CachedApi:
+
+  def __init__(self, rows):
+    self.rows = rows
+    self.reads = 0
+
+  def fetch_rows(self, table, include_personal=False, only_cache=False):
+    assert only_cache
+    self.reads += 1
+    return self.rows.get(table['id']), True
+
+  def table_version(self, table_id):
+    return [table_id, len(self.rows[table_id])] if table_id in self.rows else None
+
+def consent_rows(answers, column='fields_a'):
+  return pandas.DataFrame({
+    PERSON_KEY: [p for p, _ in answers],
+    TIME_KEY: pandas.date_range('2020-01-01', periods=len(answers), freq='h'),
+    'fields_c': ['yes'] * len(answers),
+    column: [a for _, a in answers],
+  })
+
+class TestPersonSelect(unittest.TestCase):
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.TemporaryDirectory()
+    os.chdir(self.dir.name)
+    self.api = CachedApi({
+      'T1': consent_rows([('1', 'yes'), ('2', 'yes'), ('1', 'no'), ('3', 'yes')]),
+      'T2': consent_rows([('2', 'no'), ('4', 'yes')], 'fields_b'),
+    })
+    self.sources = [{ **SOURCES[0], 'api': self.api }]
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.dir.cleanup()
+
+  def test_last_answer(self):
+    fl = Filters([{ 'table': 'T1', 'column': 'fields_a', 'value': 'yes', 'reverse': True }])
+    self.assertEqual(sorted(fl.person_select(self.sources)), ['2', '3'])
+    self.assertEqual(Filters.person_status(), { 'total': 3, 'included': 2, 'percent': 67 })
+
+  def test_combined(self):
+    fl = Filters([
+      { 'table': 'T', 'column': 'fields_a', 'value': 'yes', 'reverse': True },
+      { 'table': 'T2', 'column': 'fields_b', 'value': 'no', 'reverse': False },
+    ])
+    self.assertEqual(sorted(fl.person_select(self.sources)), ['3', '4'])
+    self.assertEqual(self.api.reads, 2)
+    self.assertEqual(sorted(fl.person_select(self.sources)), ['3', '4'])
+    self.assertEqual(self.api.reads, 2)
+    self.api.rows['T2'] = consent_rows([('2', 'no'), ('4', 'yes'), ('2', 'yes')], 'fields_b')
+    self.assertEqual(sorted(fl.person_select(self.sources)), ['2', '3', '4'])
+    self.assertEqual(self.api.reads, 4)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import pandas
+
+from llama.types.AbstractApi import AbstractApi
+from llama.types.FetchJournal import FetchJournal
+
+class TestFetchJournal(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = (self.dir.name, 'journal.jsonl')
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def test_resume(self):
+    log = FetchJournal(self.path)
+    log.record(('1-20200101000000', 'file1'), True)
+    log.record(('2-20200101000000', 'file1'), False)
+    log.close()
+    log = FetchJournal(self.path)
+    self.assertFalse(log.pending(('1-20200101000000', 'file1')))
+    self.assertTrue(log.pending(('2-20200101000000', 'file1')))
+    self.assertTrue(log.pending(('3-20200101000000', 'file1')))
+    self.assertTrue(log.pending(('2-20200101000000', 'file1'), retry_failed=True))
+    self.assertFalse(log.pending(('3-20200101000000', 'file1'), retry_failed=True))
+
+  def test_interrupted_line(self):
+    log = FetchJournal(self.path)
+    log.record(('1-20200101000000', 'meta.json'), False)
+    log.record(('1-20200101000000', 'meta.json'), True)
+    log.close()
+    with open(os.path.join(*self.path), 'a') as f:
+      f.write('{"item": "2-2020')
+    log = FetchJournal(self.path)
+    self.assertEqual(log.done, {('1-20200101000000', 'meta.json')})
+    self.assertEqual(log.failed, set())
+    log.record(('3-20200101000000', 'meta.json'), False)
+    log.close()
+    log = FetchJournal(self.path)
+    self.assertEqual(log.failed, {('3-20200101000000', 'meta.json')})
+
+class TestFetchItems(unittest.TestCase):
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.TemporaryDirectory()
+    os.chdir(self.dir.name)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.dir.cleanup()
+
+  def test_write_error(self):
+    api = AbstractApi('src')
+    rows = [{ 'Person': str(p), 'Time': pandas.Timestamp('2020-01-01') } for p in range(3)]
+    def fetch_item(row, c, path):
+      if row['Person'] == '1':
+        raise OSError('No space left on device')
+      return b'content', False
+    table = { 'id': 1, 'name': 'T' }
+    items = list(api.fetch_items(table, ((r, 'file') for r in rows), fetch_item, None, True))
+    self.assertEqual([i['content'] for i in items], [b'content', None, b'content'])
+    log = FetchJournal(api.table_journal_name(1))
+    self.assertEqual(log.failed, {('1-20200101000000', 'file')})
+    self.assertEqual(len(log.done), 2)
+
+if __name__ == '__main__':
+  unittest.main()
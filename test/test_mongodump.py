@@ -0,0 +1,104 @@
+import os
+import io
+import json
+import tempfile
+import unittest
+import contextlib
+
+from llama.types.mongodump import DEFAULT_DATABASE_CONFIG
+from llama.types.MongodumpApi import MongodumpApi
+
+def submission(i, exercise, user, status='graded'):
+  return {
+    '_id': { '$oid': f's{i:03d}' },
+    'exerciseId': f'course/round1/{exercise}',
+    'round': 'round1',
+    'title': exercise.capitalize(),
+    'received': { '$date': f'2020-01-01T00:{i:02d}:00Z' },
+    'points': i % 3,
+    'status': status,
+    'user': { '$oid': user },
+    'fields': [{ '_id': { '$oid': f'f{i}' }, 'key': 'answer', 'value': str(i) }],
+    'grading': [{ '$oid': f'g{i:03d}' }],
+    'files': [{ '$oid': f'x{i:03d}' }],
+    '__v': 0,
+  }
+
+class TestMongodump(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.cwd = os.getcwd()
+    os.chdir(self.dir.name)
+    rows = {
+      'submissions': [submission(i, f'ex{i % 2 + 1}', f'u{i % 3}', 'graded' if i != 4 else 'error') for i in range(10)],
+      'users': [{ '_id': { '$oid': f'u{i}' }, 'name': f'User {i}', 'instructor': False } for i in range(3)],
+      'gradings': [{ '_id': { '$oid': f'g{i:03d}' }, 'maxPoints': 2, 'feedback': 'ok' } for i in range(10)],
+      'files': [{ '_id': { '$oid': f'x{i:03d}' }, 'key': 'code.py', 'content': f'print({i})' } for i in range(10)],
+    }
+    for name, lines in rows.items():
+      with open(os.path.join(self.dir.name, name + '.json'), 'w') as f:
+        f.writelines(json.dumps(r) + '\n' for r in lines)
+    self.api = MongodumpApi(
+      'mongo',
+      os.path.join(self.dir.name, 'submissions.json'),
+      { **DEFAULT_DATABASE_CONFIG, 'table_filters': [tuple(f) for f in DEFAULT_DATABASE_CONFIG['table_filters']] }
+    )
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.dir.cleanup()
+
+  def fetch(self, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+      return [(t, self.api.fetch_rows_csv(t, None, *args)) for t in self.api.fetch_tables_json()]
+
+  def test_partitions(self):
+    tables = self.fetch(False, None, None)
+    self.assertEqual([t['id'] for t, _ in tables], ['ex1', 'ex2'])
+    ex1, ex2 = (rows for _, rows in tables)
+    self.assertEqual(ex1.shape[0], 4)
+    self.assertEqual(ex2.shape[0], 5)
+    self.assertEqual(list(ex1['files_0_content']), [f'print({i})' for i in (0, 2, 6, 8)])
+    self.assertEqual(set(ex1['grading_0_maxPoints']), { 2 })
+    self.assertFalse('user_name' in ex1.columns)
+
+  def test_disk_index(self):
+    self.api.LINK_MEMORY_BYTES = 0
+    ex1 = self.fetch(False, None, None)[0][1]
+    self.assertEqual(list(ex1['files_0_content']), [f'print({i})' for i in (0, 2, 6, 8)])
+
+  def test_cache(self):
+    self.fetch(False, None, None)
+    self.api = MongodumpApi('mongo', self.api.main_files[0], self.api.config)
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+      self.api.partition_dump()
+    self.assertTrue(out.getvalue().startswith('> Using parsed'))
+    with open(os.path.join(self.dir.name, 'users.json'), 'a') as f:
+      f.write(json.dumps({ '_id': { '$oid': 'u9' }, 'name': 'User 9' }) + '\n')
+    self.api = MongodumpApi('mongo', self.api.main_files[0], self.api.config)
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+      self.api.partition_dump()
+    self.assertTrue(out.getvalue().startswith('> Parsing'))
+
+  def test_shape_mismatch(self):
+    file_name = os.path.join(self.dir.name, 'mixed.json')
+    rows = [submission(0, 'ex1', 'u0'), submission(1, 'ex1', 'u1'), submission(2, 'ex1', 'u2')]
+    rows[1]['received'] = '2020-01-01'
+    rows[2]['fields'] = []
+    with open(file_name, 'w') as f:
+      f.writelines(json.dumps(r) + '\n' for r in rows)
+    with contextlib.redirect_stdout(io.StringIO()):
+      parsed = list(self.api.parse_dump_file(file_name, {}))
+    self.assertEqual([r['received'] for r in parsed], ['2020-01-01T00:00:00Z', '2020-01-01', '2020-01-01T00:02:00Z'])
+    self.assertEqual([r.get('fields_answer') for r in parsed], ['0', '1', None])
+    self.assertEqual([r['user_name'] for r in parsed], ['User 0', 'User 1', 'User 2'])
+
+  def test_persons(self):
+    tables = self.fetch(True, ['u0'], None)
+    ex1 = tables[0][1]
+    self.assertEqual(list(ex1['Person']), ['u0', 'u0'])
+    self.assertTrue('user_name' in ex1.columns)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from llama.types.AbstractDjangoApi import AbstractDjangoApi
+
+class TestPaging(unittest.TestCase):
+
+  def test_offset(self):
+    urls = AbstractDjangoApi.remaining_page_urls(
+      'https://plus.org/api/v2/courses/?limit=100&offset=100', 250, 100
+    )
+    self.assertSequenceEqual(urls, [
+      'https://plus.org/api/v2/courses/?limit=100&offset=100',
+      'https://plus.org/api/v2/courses/?limit=100&offset=200',
+    ])
+
+  def test_page_number(self):
+    urls = AbstractDjangoApi.remaining_page_urls(
+      'https://plus.org/api/v2/courses/1/exercises/?format=json&page=2', 95, 20
+    )
+    self.assertEqual(len(urls), 4)
+    self.assertEqual(urls[-1], 'https://plus.org/api/v2/courses/1/exercises/?format=json&page=5')
+
+  def test_unknown(self):
+    self.assertIsNone(AbstractDjangoApi.remaining_page_urls(None, 10, 10))
+    self.assertIsNone(AbstractDjangoApi.remaining_page_urls('https://plus.org/api/v2/courses/?cursor=x', 20, 10))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+
+from llama.common import ordered_map, line_ranges, parse_lines, configure_parse_workers
+from llama.common import lines
+from llama import FetchScheduler as scheduler
+from llama.Config import FETCH_DEFAULTS
+from llama.types.RateLimiter import TokenBucket, RateLimiter
+from llama.types.AdaptiveThrottle import AdaptiveThrottle
+
+class TestWorkers(unittest.TestCase):
+
+  def test_ordered_map_sequential(self):
+    self.assertSequenceEqual(list(ordered_map(lambda i: i * 2, range(5))), [0, 2, 4, 6, 8])
+
+  def test_ordered_map_workers(self):
+    def slow(i):
+      time.sleep(0.01 * (i % 3))
+      return i
+    self.assertSequenceEqual(list(ordered_map(slow, range(20), 4)), list(range(20)))
+
+  def test_parse_lines(self):
+    with tempfile.TemporaryDirectory() as dir:
+      file_name = os.path.join(dir, 'rows.json')
+      with open(file_name, 'w') as f:
+        f.writelines(json.dumps({ 'i': i, 'pad': 'x' * (i % 7) }) + '\n' for i in range(500))
+      ranges = list(line_ranges(file_name, 1000))
+      self.assertEqual(ranges[-1][1], os.path.getsize(file_name))
+      rows = list(parse_lines(file_name, workers=3, chunk_bytes=1000))
+      self.assertEqual([r['i'] for r in rows], list(range(500)))
+
+  def test_parse_lines_in_worker(self):
+    with tempfile.TemporaryDirectory() as dir:
+      file_name = os.path.join(dir, 'rows.json')
+      with open(file_name, 'w') as f:
+        f.writelines(json.dumps({ 'i': i }) + '\n' for i in range(100))
+      pool = lines.ProcessPoolExecutor
+      def nested(*args, **kwargs):
+        raise AssertionError('daemonic processes are not allowed to have children')
+      lines.ProcessPoolExecutor = nested
+      try:
+        configure_parse_workers(1)
+        rows = list(parse_lines(file_name, chunk_bytes=100))
+      finally:
+        configure_parse_workers(None)
+        lines.ProcessPoolExecutor = pool
+      self.assertEqual([r['i'] for r in rows], list(range(100)))
+
+  def test_scheduler_failed(self):
+    class FailingApi:
+      FETCH_POOL = 'thread'
+      fetch_options = { 'workers': 2 }
+      def fetch_rows(self, table, *args):
+        raise OSError(table['name'])
+    source = { 'name': 'x', 'api': FailingApi(), 'tables': [{ 'name': 'a' }, { 'name': 'b' }] }
+    pool = scheduler.ProcessPoolExecutor
+    def unused(*args, **kwargs):
+      raise AssertionError('no process sources')
+    scheduler.ProcessPoolExecutor = unused
+    try:
+      self.assertEqual(scheduler.FetchScheduler().run([source], False, None), ['x'])
+    finally:
+      scheduler.ProcessPoolExecutor = pool
+
+  def test_token_bucket_debt(self):
+    bucket = TokenBucket(10, burst=2)
+    self.assertEqual(bucket.reserve(), 0)
+    self.assertEqual(bucket.reserve(), 0)
+    self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+    self.assertAlmostEqual(bucket.reserve(), 0.2, places=2)
+
+  def test_rate_limiter_per_host(self):
+    limiter = RateLimiter(1)
+    a = limiter.bucket('https://a.org/api/v2/courses/')
+    self.assertIs(a, limiter.bucket('https://a.org/api/v2/submissions/1'))
+    self.assertIsNot(a, limiter.bucket('https://b.org/api/v2/courses/'))
+
+  def test_adaptive_increase(self):
+    throttle = AdaptiveThrottle({ **FETCH_DEFAULTS, 'workers': 4, 'start_rate': 1.0, 'rate': 2.0 })
+    url = 'https://a.org/api/v2/courses/'
+    for _ in range(10):
+      throttle.host_throttle(url).inflight += 1
+      throttle.release(url, 200, 0.1)
+    state = throttle.state()['a.org']
+    self.assertEqual(state['rate'], 2.0)
+    self.assertEqual(state['workers'], 4)
+
+  def test_adaptive_decrease(self):
+    throttle = AdaptiveThrottle({ **FETCH_DEFAULTS, 'start_rate': 1.0, 'min_rate': 0.25 })
+    url = 'https://a.org/api/v2/courses/'
+    for status in (429, 503, 429):
+      throttle.host_throttle(url).inflight += 1
+      throttle.release(url, status, 0.1, '2')
+    self.assertEqual(throttle.state()['a.org']['rate'], 0.25)
+    self.assertGreater(throttle.host_throttle(url).blocked_until, time.monotonic() + 1)
+
+  def test_retry_after(self):
+    self.assertEqual(AdaptiveThrottle.parse_retry_after('3'), 3)
+    self.assertEqual(AdaptiveThrottle.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+    self.assertIsNone(AdaptiveThrottle.parse_retry_after('soon'))
+
+if __name__ == '__main__':
+  unittest.main()